@@ -0,0 +1,460 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+import redis
+import requests
+
+import cms_helpers
+import db_helpers
+import rate_limit
+
+
+logger = logging.getLogger('cache_helpers')
+
+CATALOGUE_TTL = 300
+CATALOGUE_KEY = 'catalogue:products'
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+IMAGE_LINKS_KEY = 'image_links'
+IMAGE_LINKS_CACHE_SIZE = 512
+PRODUCT_CARDS_KEY = 'product_cards'
+PRODUCT_CARDS_CACHE_SIZE = 512
+PIZZERIAS_KEY = 'pizzerias'
+GEOCODE_KEY = 'geocode:{address}'
+GEOCODE_CACHE_SIZE = 1024
+GEOCODE_TTL = 30 * 24 * 60 * 60
+GEOCODE_NOT_FOUND_TTL = 24 * 60 * 60
+GEOCODE_NOT_FOUND = ''
+ADDRESS_SEPARATORS = re.compile(r'[\s,.;:"«»()]+')
+
+_catalogue = None
+_catalogue_version = 0
+_catalogue_lock = threading.Lock()
+_catalogue_refresh_lock = threading.Lock()
+
+
+class LRUCache:
+    '''
+    Потокобезопасный LRU-кэш в памяти процесса с необязательным TTL.
+    '''
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                value, expires = self._items[key]
+                if expires is None or expires > time.time():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, expires = self._items.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get_stats(self):
+        requests_count = self.hits + self.misses
+        hit_rate = self.hits / requests_count if requests_count else 0
+        return {
+            'size': len(self._items),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(hit_rate, 3),
+        }
+
+
+_image_links = LRUCache(maxsize=IMAGE_LINKS_CACHE_SIZE)
+_product_cards = LRUCache(maxsize=PRODUCT_CARDS_CACHE_SIZE)
+_pizzerias = None
+_geocodes = LRUCache(maxsize=GEOCODE_CACHE_SIZE)
+_geocode_stats = {'redis_hits': 0, 'redis_misses': 0, 'requests': 0,
+                                                        'not_found': 0}
+_geocode_stats_lock = threading.Lock()
+
+
+def get_catalogue_ttl():
+    return int(os.getenv('CATALOGUE_TTL', CATALOGUE_TTL))
+
+
+def get_catalogue_version():
+    if not db_helpers.is_database_configured():
+        return _catalogue_version
+    try:
+        db = db_helpers.get_database_connection()
+        return int(db.get(CATALOGUE_VERSION_KEY) or 0)
+    except redis.RedisError:
+        logger.warning('Не удалось получить версию каталога', exc_info=True)
+        if _catalogue:
+            return _catalogue['version']
+        return _catalogue_version
+
+
+def bump_catalogue_version():
+    '''
+    Вызывается после публикации каталога: все экземпляры бота
+    при следующем обращении загрузят каталог заново.
+    '''
+    global _catalogue, _catalogue_version
+    with _catalogue_lock:
+        _catalogue = None
+        _catalogue_version += 1
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            _catalogue_version = db.incr(CATALOGUE_VERSION_KEY)
+            db.delete(CATALOGUE_KEY)
+        except redis.RedisError:
+            logger.warning('Не удалось обновить версию каталога в Redis: '
+                            'боты загрузят новый каталог по истечении '
+                            'CATALOGUE_TTL', exc_info=True)
+    logger.info(f'Версия каталога: {_catalogue_version}')
+
+    return _catalogue_version
+
+
+def _load_shared_catalogue(version=None):
+    if not db_helpers.is_database_configured():
+        return None
+    try:
+        db = db_helpers.get_database_connection()
+        shared_catalogue = db.get(CATALOGUE_KEY)
+    except redis.RedisError:
+        logger.warning('Не удалось прочитать каталог из Redis', exc_info=True)
+        return None
+    if not shared_catalogue:
+        return None
+    shared_catalogue = json.loads(shared_catalogue)
+    if version is not None and shared_catalogue['version'] != version:
+        return None
+
+    return shared_catalogue
+
+
+def _store_catalogue(products, version):
+    global _catalogue
+    catalogue = {
+        'version': version,
+        'fetched_at': time.time(),
+        'products': products,
+    }
+    _catalogue = catalogue
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.set(CATALOGUE_KEY, json.dumps(catalogue))
+        except redis.RedisError:
+            logger.warning('Не удалось сохранить каталог в Redis',
+                                                            exc_info=True)
+    return catalogue
+
+
+def _fetch_products():
+    return {'data': list(cms_helpers.iter_products())}
+
+
+def _fetch_catalogue(version):
+    with _catalogue_lock:
+        if _catalogue and _catalogue['version'] == version:
+            return _catalogue
+        logger.debug(f'Загрузка каталога версии {version}')
+        return _store_catalogue(_fetch_products(), version)
+
+
+def _refresh_catalogue_in_background(version):
+    if not cms_helpers.is_cms_available():
+        return
+    if not _catalogue_refresh_lock.acquire(blocking=False):
+        return
+
+    def refresh_catalogue():
+        try:
+            with rate_limit.priority(rate_limit.BULK):
+                _store_catalogue(_fetch_products(), version)
+        except requests.exceptions.RequestException:
+            logger.warning('Не удалось обновить каталог', exc_info=True)
+        finally:
+            _catalogue_refresh_lock.release()
+
+    threading.Thread(target=refresh_catalogue, daemon=True).start()
+
+
+def get_products():
+    '''
+    Каталог из кэша. Устаревший по TTL каталог отдаётся сразу,
+    а свежий загружается в фоне. Синхронно CMS запрашивается только
+    при пустом кэше и после смены версии каталога. Если CMS при этом
+    недоступна, отдаётся последний сохранённый каталог.
+    '''
+    global _catalogue
+    version = get_catalogue_version()
+    catalogue = _catalogue
+    if catalogue is None or catalogue['version'] != version:
+        catalogue = _load_shared_catalogue(version)
+        if catalogue is None:
+            try:
+                catalogue = _fetch_catalogue(version)
+            except requests.exceptions.RequestException as error:
+                if not cms_helpers.is_cms_outage(error):
+                    raise
+                stale_catalogue = _catalogue or _load_shared_catalogue()
+                if not stale_catalogue:
+                    raise
+                logger.warning('CMS недоступна, отдаём сохранённый каталог',
+                                                            exc_info=True)
+                return stale_catalogue['products']
+        _catalogue = catalogue
+
+    if time.time() - catalogue['fetched_at'] > get_catalogue_ttl():
+        _refresh_catalogue_in_background(version)
+
+    return catalogue['products']
+
+
+def remember_image_link(image_id, image_link):
+    _image_links.set(image_id, image_link)
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.hset(IMAGE_LINKS_KEY, image_id, image_link)
+        except redis.RedisError:
+            logger.warning('Не удалось сохранить ссылку на картинку в Redis',
+                                                            exc_info=True)
+
+
+def get_image_link(image_id):
+    '''
+    Ссылка на загруженный в CMS файл не меняется, поэтому её можно
+    хранить бессрочно: сначала ищем в памяти, затем в Redis,
+    и только потом спрашиваем CMS.
+    '''
+    image_link = _image_links.get(image_id)
+    if image_link:
+        return image_link
+
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            image_link = db.hget(IMAGE_LINKS_KEY, image_id)
+        except redis.RedisError:
+            logger.warning('Не удалось прочитать ссылку на картинку из Redis',
+                                                            exc_info=True)
+        if image_link:
+            image_link = image_link.decode('utf-8')
+            _image_links.set(image_id, image_link)
+            return image_link
+
+    image_link = cms_helpers.get_image_link(image_id)
+    remember_image_link(image_id, image_link)
+
+    return image_link
+
+
+def get_product_card(product_id):
+    '''
+    Карточка товара всегда запрашивается у CMS, чтобы цена была
+    актуальной. Последняя полученная карточка сохраняется и
+    показывается, пока CMS недоступна.
+    '''
+    try:
+        product_card = cms_helpers.get_product_card(product_id)
+    except requests.exceptions.RequestException as error:
+        if not cms_helpers.is_cms_outage(error):
+            raise
+        product_card = _product_cards.get(product_id)
+        if product_card is None and db_helpers.is_database_configured():
+            try:
+                db = db_helpers.get_database_connection()
+                product_card = db.hget(PRODUCT_CARDS_KEY, product_id)
+            except redis.RedisError:
+                logger.warning('Не удалось прочитать карточку из Redis',
+                                                            exc_info=True)
+            if product_card:
+                product_card = json.loads(product_card)
+        if not product_card:
+            raise
+        logger.warning(f'CMS недоступна, отдаём сохранённую карточку '
+                                        f'товара {product_id}', exc_info=True)
+        return product_card
+
+    _product_cards.set(product_id, product_card)
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.hset(PRODUCT_CARDS_KEY, product_id, json.dumps(product_card))
+        except redis.RedisError:
+            logger.warning('Не удалось сохранить карточку в Redis',
+                                                            exc_info=True)
+    return product_card
+
+
+def _load_shared_pizzerias():
+    if not db_helpers.is_database_configured():
+        return None
+    try:
+        db = db_helpers.get_database_connection()
+        pizzerias = db.get(PIZZERIAS_KEY)
+    except redis.RedisError:
+        logger.warning('Не удалось прочитать пиццерии из Redis', exc_info=True)
+        return None
+    if pizzerias:
+        return json.loads(pizzerias)
+
+
+def get_pizzerias():
+    '''
+    Список пиццерий из CMS. Пока CMS недоступна, отдаётся
+    последний полученный список.
+    '''
+    global _pizzerias
+    try:
+        pizzerias = list(cms_helpers.iter_entries('pizzeria'))
+    except requests.exceptions.RequestException as error:
+        if not cms_helpers.is_cms_outage(error):
+            raise
+        pizzerias = _pizzerias or _load_shared_pizzerias()
+        if not pizzerias:
+            raise
+        logger.warning('CMS недоступна, отдаём сохранённый список пиццерий',
+                                                            exc_info=True)
+        return pizzerias
+
+    _pizzerias = pizzerias
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.set(PIZZERIAS_KEY, json.dumps(pizzerias))
+        except redis.RedisError:
+            logger.warning('Не удалось сохранить пиццерии в Redis',
+                                                            exc_info=True)
+    return pizzerias
+
+
+def get_pizzeria(pizzeria_id):
+    try:
+        return cms_helpers.get_an_entry('pizzeria', pizzeria_id)['data']
+    except requests.exceptions.RequestException as error:
+        if not cms_helpers.is_cms_outage(error):
+            raise
+        pizzerias = _pizzerias or _load_shared_pizzerias() or []
+        for pizzeria in pizzerias:
+            if pizzeria['id'] == pizzeria_id:
+                logger.warning('CMS недоступна, отдаём сохранённую пиццерию',
+                                                            exc_info=True)
+                return pizzeria
+        raise
+
+
+def normalize_address(address):
+    '''
+    Адрес без различий в регистре, пробелах и знаках препинания:
+    «Москва, ул. Тверская 1» и «москва ул тверская  1» дают один ключ.
+    '''
+    address = address.lower().replace('ё', 'е')
+    return ' '.join(ADDRESS_SEPARATORS.split(address)).strip()
+
+
+def get_geocode_ttl(not_found=False):
+    if not_found:
+        return int(os.getenv('GEOCODE_NOT_FOUND_TTL', GEOCODE_NOT_FOUND_TTL))
+    return int(os.getenv('GEOCODE_TTL', GEOCODE_TTL))
+
+
+def _count_geocode(counter):
+    with _geocode_stats_lock:
+        _geocode_stats[counter] += 1
+
+
+def _remember_coordinates(key, location):
+    location = location or GEOCODE_NOT_FOUND
+    ttl = get_geocode_ttl(not_found=not location)
+    _geocodes.set(key, location, ttl=ttl)
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.set(GEOCODE_KEY.format(address=key), location, ex=ttl)
+        except redis.RedisError:
+            logger.warning('Не удалось сохранить координаты адреса в Redis',
+                                                            exc_info=True)
+
+
+def get_coordinates(address, geocode):
+    '''
+    Координаты адреса в виде 'долгота широта', как их отдаёт геокодер,
+    или None, если адрес не найден. Ищем сначала в памяти, затем
+    в Redis, и только потом вызываем geocode(address). Ненайденные
+    адреса тоже запоминаются, но на меньший срок.
+    '''
+    key = normalize_address(address)
+    if not key:
+        return None
+
+    location = _geocodes.get(key)
+    if location is not None:
+        return location or None
+
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            location = db.get(GEOCODE_KEY.format(address=key))
+        except redis.RedisError:
+            logger.warning('Не удалось прочитать координаты адреса из Redis',
+                                                            exc_info=True)
+        if location is not None:
+            _count_geocode('redis_hits')
+            location = location.decode('utf-8')
+            _geocodes.set(key, location, ttl=get_geocode_ttl(not location))
+            return location or None
+        _count_geocode('redis_misses')
+
+    _count_geocode('requests')
+    location = geocode(address)
+    if not location:
+        _count_geocode('not_found')
+    _remember_coordinates(key, location)
+
+    return location
+
+
+def get_geocode_stats():
+    with _geocode_stats_lock:
+        stats = dict(_geocode_stats)
+    stats['memory'] = _geocodes.get_stats()
+    return stats
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,241 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import json
+import logging
+import threading
+
+from collections import defaultdict
+
+import redis
+import requests
+
+import cms_helpers
+import db_helpers
+from cache_helpers import LRUCache
+
+
+logger = logging.getLogger('cart_helpers')
+
+CART_KEY = 'cart:{chat_id}'
+CART_TTL = 24 * 60 * 60
+CARTS_CACHE_SIZE = 1024
+CART_DEBOUNCE = 1.5
+CART_RETRY_DELAY = 2
+CART_MAX_RETRIES = 5
+
+_carts = LRUCache(maxsize=CARTS_CACHE_SIZE, ttl=CART_TTL)
+_pending = {}
+_flushing = {}
+_pending_lock = threading.Lock()
+
+
+def _get_cart_key(chat_id):
+    return CART_KEY.format(chat_id=chat_id)
+
+
+def load_cart(chat_id):
+    '''
+    Копия корзины из Redis (или из памяти, если Redis не настроен):
+    {'version': ..., 'items': <ответ CMS со списком товаров>}
+    '''
+    if not db_helpers.is_database_configured():
+        return _carts.get(chat_id)
+    try:
+        db = db_helpers.get_database_connection()
+        version, cart_items = db.hmget(_get_cart_key(chat_id),
+                                                    'version', 'items')
+    except redis.RedisError:
+        logger.warning('Не удалось прочитать корзину из Redis', exc_info=True)
+        return None
+    if cart_items is None:
+        return None
+
+    return {'version': int(version), 'items': json.loads(cart_items)}
+
+
+def save_cart(chat_id, cart_items):
+    '''
+    Сохраняет состояние корзины из ответа CMS и увеличивает её версию.
+    '''
+    if not db_helpers.is_database_configured():
+        cart = _carts.get(chat_id) or {'version': 0}
+        cart = {'version': cart['version'] + 1, 'items': cart_items}
+        _carts.set(chat_id, cart)
+        return cart['version']
+
+    cart_key = _get_cart_key(chat_id)
+    try:
+        db = db_helpers.get_database_connection()
+        pipeline = db.pipeline()
+        pipeline.hincrby(cart_key, 'version', 1)
+        pipeline.hset(cart_key, 'items', json.dumps(cart_items))
+        pipeline.expire(cart_key, CART_TTL)
+        version, *_ = pipeline.execute()
+    except redis.RedisError:
+        logger.warning('Не удалось сохранить корзину в Redis', exc_info=True)
+        drop_cart(chat_id)
+        return None
+
+    return version
+
+
+def drop_cart(chat_id):
+    _carts.pop(chat_id)
+    if db_helpers.is_database_configured():
+        try:
+            db = db_helpers.get_database_connection()
+            db.delete(_get_cart_key(chat_id))
+        except redis.RedisError:
+            logger.warning('Не удалось удалить корзину из Redis',
+                                                            exc_info=True)
+
+
+def _get_pending(chat_id):
+    pending = _pending.get(chat_id)
+    if pending is None:
+        pending = {'products': defaultdict(int), 'timer': None, 'attempts': 0}
+        _pending[chat_id] = pending
+    return pending
+
+
+def _schedule_flush(chat_id, pending, delay):
+    if pending['timer']:
+        pending['timer'].cancel()
+    pending['timer'] = threading.Timer(
+        delay,
+        _flush_cart_in_background,
+        args=(chat_id,),
+    )
+    pending['timer'].daemon = True
+    pending['timer'].start()
+
+
+def _queue_cart_change(chat_id, product_id, quantity):
+    with _pending_lock:
+        pending = _get_pending(chat_id)
+        pending['products'][product_id] += quantity
+        _schedule_flush(chat_id, pending, CART_DEBOUNCE)
+
+
+def _requeue_cart_changes(chat_id, failed):
+    '''
+    Возвращает в очередь изменения, которые не удалось отправить в CMS,
+    и повторяет отправку с растущей паузой. После CART_MAX_RETRIES
+    попыток фоновые повторы прекращаются, но изменения остаются
+    в очереди: их отправит следующий показ корзины, оформление заказа
+    или новое нажатие, и товары не пропадут из корзины молча.
+    '''
+    with _pending_lock:
+        pending = _get_pending(chat_id)
+        for product_id, quantity in failed['products'].items():
+            pending['products'][product_id] += quantity
+        pending['attempts'] = max(pending['attempts'],
+                                                failed['attempts'] + 1)
+        if pending['attempts'] > CART_MAX_RETRIES:
+            if pending['timer']:
+                pending['timer'].cancel()
+                pending['timer'] = None
+            logger.error(f'Изменения корзины {chat_id} не отправлены после '
+                            f'{CART_MAX_RETRIES} попыток, ждём следующего '
+                            f'обращения к корзине: '
+                            f'{dict(pending["products"])}')
+            return
+        _schedule_flush(
+            chat_id,
+            pending,
+            CART_RETRY_DELAY * 2 ** (pending['attempts'] - 1),
+        )
+
+
+def _apply_cart_changes(chat_id, products):
+    cart_items = cms_helpers.add_products_to_cart(chat_id, products)
+    save_cart(chat_id, cart_items)
+
+
+def flush_cart(chat_id):
+    '''
+    Отправляет в CMS накопленные изменения корзины. Если изменения
+    этой корзины уже отправляет другой поток, дожидается его.
+    '''
+    while True:
+        with _pending_lock:
+            flushing = _flushing.get(chat_id)
+            if flushing is None:
+                pending = _pending.pop(chat_id, None)
+                if pending is None:
+                    return
+                if pending['timer']:
+                    pending['timer'].cancel()
+                flushing = threading.Event()
+                _flushing[chat_id] = flushing
+                break
+        flushing.wait()
+
+    try:
+        logger.debug(f'Изменения корзины {chat_id}: '
+                                            f'{dict(pending["products"])}')
+        _apply_cart_changes(chat_id, pending['products'])
+    except requests.exceptions.RequestException:
+        _requeue_cart_changes(chat_id, pending)
+        raise
+    finally:
+        with _pending_lock:
+            del _flushing[chat_id]
+        flushing.set()
+
+
+def _flush_cart_in_background(chat_id):
+    try:
+        flush_cart(chat_id)
+    except requests.exceptions.RequestException:
+        logger.warning(f'Не удалось обновить корзину {chat_id}',
+                                                            exc_info=True)
+
+
+def get_cart_items(chat_id, flush=True):
+    if flush:
+        flush_cart(chat_id)
+    cart = load_cart(chat_id)
+    if cart:
+        return cart['items']
+
+    cart_items = cms_helpers.get_cart_items(chat_id)
+    save_cart(chat_id, cart_items)
+
+    return cart_items
+
+
+def add_product_to_cart(chat_id, product_id, quantity=1):
+    '''
+    Изменения корзины копятся CART_DEBOUNCE секунд после последнего
+    нажатия и уходят в CMS одним запросом с суммарными количествами.
+    '''
+    _queue_cart_change(chat_id, product_id, quantity)
+
+
+def remove_cart_item(chat_id, item_id):
+    flush_cart(chat_id)
+    cart_items = cms_helpers.remove_cart_item(chat_id, item_id)
+    save_cart(chat_id, cart_items)
+
+    return cart_items
+
+
+def reconcile_cart(chat_id):
+    '''
+    Сверяет копию корзины с CMS перед оформлением заказа.
+    '''
+    flush_cart(chat_id)
+    cart = load_cart(chat_id)
+    cart_items = cms_helpers.get_cart_items(chat_id)
+    if cart and cart['items'] != cart_items:
+        logger.warning(f'Корзина {chat_id} версии {cart["version"]} '
+                                                f'расходится с CMS')
+    version = save_cart(chat_id, cart_items)
+    logger.debug(f'Корзина {chat_id} сверена с CMS, версия {version}')
+
+    return cart_items
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,89 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger('circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+
+class CmsUnavailableError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    '''
+    После failure_threshold сбоев подряд размыкается: запросы сразу
+    завершаются ошибкой CmsUnavailableError, не дожидаясь таймаутов.
+    Пока цепь разомкнута, фоновый поток раз в reset_timeout секунд
+    вызывает probe() и замыкает цепь после первой удачной проверки.
+    '''
+    def __init__(self, failure_threshold, reset_timeout, probe):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def is_closed(self):
+        return self.state == CLOSED
+
+    def before_request(self):
+        if self.state == OPEN:
+            raise CmsUnavailableError(
+                f'CMS недоступна, повторная проверка через '
+                f'{self.reset_timeout} сек.'
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == OPEN or self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+        logger.error(f'CMS недоступна после {self.failures} сбоев подряд, '
+                                        f'запросы временно не отправляются')
+        probe_thread = threading.Thread(
+            target=self._probe_until_closed,
+            name='circuit_breaker',
+            daemon=True,
+        )
+        probe_thread.start()
+
+    def _probe_until_closed(self):
+        while self.state == OPEN:
+            time.sleep(self.reset_timeout)
+            try:
+                self.probe()
+            except requests.exceptions.RequestException as error:
+                logger.warning(f'CMS всё ещё недоступна: {error}')
+                continue
+            with self._lock:
+                self.state = CLOSED
+                self.failures = 0
+                self.opened_at = None
+            logger.info('CMS снова доступна')
+
+    def get_stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened_at': self.opened_at,
+        }
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,126 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import asyncio
+import logging
+import os
+import threading
+
+import aiohttp
+
+import cms_helpers
+import rate_limit
+
+
+logger = logging.getLogger('cms_async')
+
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+
+
+def get_event_loop():
+    '''
+    Событийный цикл в отдельном фоновом потоке. На нём выполняются все
+    асинхронные запросы к CMS, а обработчики бота забирают их
+    результаты из Future, который возвращает submit().
+    '''
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop_thread = threading.Thread(
+                    target=loop.run_forever,
+                    name='cms_async',
+                    daemon=True,
+                )
+                loop_thread.start()
+                _loop = loop
+    return _loop
+
+
+def get_session():
+    global _session
+    if _session is None:
+        pool_size = int(os.getenv('CMS_POOL_SIZE',
+                                        cms_helpers.DEFAULT_POOL_SIZE))
+        connector = aiohttp.TCPConnector(limit=pool_size * 2)
+        timeout = aiohttp.ClientTimeout(
+            connect=float(os.getenv('CMS_CONNECT_TIMEOUT',
+                                    cms_helpers.DEFAULT_CONNECT_TIMEOUT)),
+            sock_read=float(os.getenv('CMS_READ_TIMEOUT',
+                                    cms_helpers.DEFAULT_READ_TIMEOUT)),
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+def submit(coroutine):
+    '''
+    Запускает запрос к CMS в фоне и сразу возвращает
+    concurrent.futures.Future, результат которого можно забрать позже.
+    '''
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+
+def run(coroutine, timeout=None):
+    return submit(coroutine).result(timeout)
+
+
+async def get_headers(content_type=True):
+    loop = asyncio.get_running_loop()
+    api_token = await loop.run_in_executor(
+        None,
+        cms_helpers.get_moltin_api_token,
+    )
+    headers = {'Authorization': api_token}
+    if content_type:
+        headers['Content-Type'] = 'application/json'
+
+    return headers
+
+
+async def _make_request(method, url, content_type=True,
+                                throttle_retries=None, **kwargs):
+    if throttle_retries is None:
+        throttle_retries = cms_helpers.THROTTLE_RETRIES
+    headers = await get_headers(content_type)
+    breaker = cms_helpers.get_circuit_breaker()
+    bucket = rate_limit.get_bucket()
+    loop = asyncio.get_running_loop()
+    session = get_session()
+    for attempt in range(throttle_retries + 1):
+        breaker.before_request()
+        await loop.run_in_executor(None, bucket.acquire)
+        try:
+            async with session.request(method, url, headers=headers,
+                                                    **kwargs) as response:
+                logger.debug(f'{method} {url}: {response.status}')
+                if response.status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status == 429 and attempt < throttle_retries:
+                    delay = rate_limit.get_retry_delay(response, attempt)
+                    logger.warning(f'CMS ограничивает частоту запросов, '
+                                        f'повтор через {delay:.1f} сек.')
+                    bucket.pause(delay)
+                    continue
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            breaker.record_failure()
+            raise
+
+
+async def create_entry(flow_name, entry_data):
+    slug = flow_name.lower().replace(' ', '_')
+    url = f'{cms_helpers.get_base_url()}/flows/{slug}/entries'
+    entry_data['type'] = 'entry'
+    payload = {'data': entry_data}
+
+    return await _make_request('POST', url, json=payload)
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
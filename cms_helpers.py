@@ -1,79 +1,492 @@
 __author__ = 'ArkJzzz (arkjzzz@gmail.com)'
 
+import hashlib
 import logging
 import os
+import threading
+import time
+import uuid
+import redis
 import requests
 import json
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import circuit_breaker
+import db_helpers
+import rate_limit
 
-logger = logging.getLogger('cms_helpers')
 
-BASE_URL = 'https://api.moltin.com/v2'
+logger = logging.getLogger('cms_helpers')
 
+DEFAULT_API_URL = 'https://api.moltin.com'
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.3
+PAGE_LIMIT = 100
+THROTTLE_RETRIES = 5
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30
+
+TOKEN_REFRESH_MARGIN = 120
+TOKEN_RETRY_DELAY = 10
+TOKEN_REDIS_KEY = 'moltin_autorization_data'
+TOKEN_REDIS_LOCK = 'moltin_autorization_lock'
+TOKEN_REDIS_LOCK_TIMEOUT = 15
+
+_api_url = None
+_moltin_credentials = None
 _moltin_autorization_data = None
+_token_lock = threading.Lock()
+_token_refresh_timer = None
+_session = None
+_session_lock = threading.Lock()
+_timeout = None
+_circuit_breaker = None
+
+
+def get_api_url():
+    '''
+    Адрес API из set_api_url() или из ELASTICPATH_API_URL. Переменная
+    читается при каждом запросе, поэтому адрес из .env подхватывается
+    и после load_dotenv().
+    '''
+    if _api_url is not None:
+        return _api_url
+    return os.getenv('ELASTICPATH_API_URL', DEFAULT_API_URL).rstrip('/')
+
+
+def get_base_url():
+    return f'{get_api_url()}/v2'
+
+
+def set_api_url(api_url):
+    '''
+    Переключает клиент на другой адрес API, например на локальную
+    заглушку moltin_stub.
+    '''
+    global _api_url, _moltin_autorization_data
+    _api_url = api_url.rstrip('/')
+    with _token_lock:
+        _moltin_autorization_data = None
+
+
+def get_session(pool_size=None):
+    '''
+    Возвращает общую для всех потоков сессию с пулом keep-alive соединений.
+    Размер пула должен совпадать с числом воркеров диспетчера бота.
+    '''
+    global _session, _timeout
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                if pool_size is None:
+                    pool_size = int(os.getenv('CMS_POOL_SIZE',
+                                                    DEFAULT_POOL_SIZE))
+                max_retries = Retry(
+                    total=int(os.getenv('CMS_MAX_RETRIES',
+                                                    DEFAULT_MAX_RETRIES)),
+                    backoff_factor=float(os.getenv('CMS_RETRY_BACKOFF',
+                                                    DEFAULT_RETRY_BACKOFF)),
+                    status_forcelist=(500, 502, 503, 504),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=2,
+                    pool_maxsize=pool_size,
+                    max_retries=max_retries,
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _timeout = (
+                    float(os.getenv('CMS_CONNECT_TIMEOUT',
+                                                DEFAULT_CONNECT_TIMEOUT)),
+                    float(os.getenv('CMS_READ_TIMEOUT',
+                                                DEFAULT_READ_TIMEOUT)),
+                )
+                _session = session
+                logger.debug(f'Создан пул соединений на {pool_size} '
+                                                            f'соединений')
+    return _session
+
+
+def get_session_stats():
+    '''
+    Статистика пулов соединений: сколько запросов отправлено и сколько
+    соединений для этого пришлось открыть.
+    '''
+    session = get_session()
+    pools_stats = []
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            pools_stats.append({
+                'host': f'{pool.scheme}://{pool.host}:{pool.port}',
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'idle_connections': pool.pool.qsize() if pool.pool else 0,
+            })
+
+    total_requests = sum(stats['requests'] for stats in pools_stats)
+    total_connections = sum(stats['connections'] for stats in pools_stats)
+    reuse_rate = 0
+    if total_requests:
+        reuse_rate = 1 - total_connections / total_requests
+
+    return {
+        'pools': pools_stats,
+        'requests': total_requests,
+        'connections': total_connections,
+        'reuse_rate': round(reuse_rate, 3),
+    }
+
+
+def _probe_cms():
+    response = get_session().get(get_base_url(), timeout=_timeout)
+    if response.status_code >= 500:
+        response.raise_for_status()
+
+
+def get_circuit_breaker():
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        with _session_lock:
+            if _circuit_breaker is None:
+                _circuit_breaker = circuit_breaker.CircuitBreaker(
+                    failure_threshold=int(os.getenv('CMS_BREAKER_THRESHOLD',
+                                            DEFAULT_BREAKER_THRESHOLD)),
+                    reset_timeout=float(os.getenv('CMS_BREAKER_RESET',
+                                            DEFAULT_BREAKER_RESET)),
+                    probe=_probe_cms,
+                )
+    return _circuit_breaker
+
+
+def is_cms_available():
+    return get_circuit_breaker().is_closed()
+
+
+def is_cms_outage(error):
+    '''
+    Ошибка говорит о сбое самой CMS: нет соединения, истёк таймаут,
+    цепь разомкнута или CMS ответила 5xx. Ответы 4xx означают ошибку
+    в запросе, и сохранёнными данными их подменять нельзя.
+    '''
+    if isinstance(error, (requests.exceptions.ConnectionError,
+                                        requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+
+def _make_request(method, url, throttle_retries=THROTTLE_RETRIES, **kwargs):
+    session = get_session()
+    kwargs.setdefault('timeout', _timeout)
+    bucket = rate_limit.get_bucket()
+    breaker = get_circuit_breaker()
+    for attempt in range(throttle_retries + 1):
+        breaker.before_request()
+        bucket.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError,
+                                        requests.exceptions.Timeout):
+            breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if response.status_code != 429 or attempt == throttle_retries:
+            break
+        delay = rate_limit.get_retry_delay(response, attempt)
+        logger.warning(f'CMS ограничивает частоту запросов, '
+                                        f'повтор через {delay:.1f} сек.')
+        bucket.pause(delay)
+
+    return response
+
+
+def _get_page(url, page_limit, offset):
+    headers = {
+        'Authorization': get_moltin_api_token(),
+        'Content-Type': 'application/json',
+    }
+    params = {
+        'page[limit]': page_limit,
+        'page[offset]': offset,
+    }
+    response = _make_request('GET', url, headers=headers, params=params)
+    response.raise_for_status()
+
+    return response.json()
+
+
+def _has_next_page(page, next_offset, page_limit):
+    results_total = page.get('meta', {}).get('results', {}).get('total')
+    if results_total is not None:
+        return next_offset < int(results_total)
+    return len(page['data']) == page_limit
+
+
+def iter_pages(url, page_limit=PAGE_LIMIT, prefetch=True):
+    '''
+    Обходит постраничный список CMS по page[limit]/page[offset] и отдаёт
+    записи по одной. Пока вызывающий код разбирает текущую страницу,
+    следующая загружается в фоне. Обход можно прервать в любой момент.
+    '''
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    # Следующая страница загружается с тем же приоритетом,
+    # что и у потока, который обходит список.
+    page_priority = rate_limit.get_priority()
+
+    def prefetch_page(offset):
+        with rate_limit.priority(page_priority):
+            return _get_page(url, page_limit, offset)
+
+    try:
+        offset = 0
+        page = _get_page(url, page_limit, offset)
+        while True:
+            offset += page_limit
+            has_next_page = _has_next_page(page, offset, page_limit)
+            next_page = None
+            if has_next_page and executor:
+                next_page = executor.submit(prefetch_page, offset)
+
+            yield from page['data']
+
+            if not has_next_page:
+                return
+            if next_page:
+                page = next_page.result()
+            else:
+                page = _get_page(url, page_limit, offset)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def get_moltin_credentials():
+    global _moltin_credentials
+    if _moltin_credentials is None:
+        load_dotenv()
+        _moltin_credentials = {
+            'client_id': os.getenv('ELASTICPATH_CLIENT_ID'),
+            'client_secret': os.getenv('ELASTICPATH_CLIENT_SECRET'),
+        }
+    return _moltin_credentials
 
 
 def get_moltin_autorization():
-    load_dotenv()
-    moltin_client_id = os.getenv('ELASTICPATH_CLIENT_ID')
-    moltin_client_secret = os.getenv('ELASTICPATH_CLIENT_SECRET')
-    url = 'https://api.moltin.com/oauth/access_token'
+    credentials = get_moltin_credentials()
+    url = f'{get_api_url()}/oauth/access_token'
     data = {
-      'client_id': moltin_client_id,
-      'client_secret': moltin_client_secret,
+      'client_id': credentials['client_id'],
+      'client_secret': credentials['client_secret'],
       'grant_type': 'client_credentials'
     }
-    response = requests.post(url, data=data)
+    response = _make_request('POST', url, data=data)
     response.raise_for_status()
     logger.debug(response.json())
 
     return response.json()
 
 
-def get_moltin_api_token():
+def is_token_fresh(autorization_data, margin=TOKEN_REFRESH_MARGIN):
+    if not autorization_data:
+        return False
+    return time.time() < int(autorization_data['expires']) - margin
+
+
+def _load_shared_autorization():
+    if not db_helpers.is_database_configured():
+        return None
+    try:
+        db = db_helpers.get_database_connection()
+        shared_data = db.get(TOKEN_REDIS_KEY)
+    except redis.RedisError:
+        logger.warning('Не удалось прочитать токен из Redis', exc_info=True)
+        return None
+    if shared_data:
+        return json.loads(shared_data)
+
+
+def _save_shared_autorization(autorization_data):
+    expires_in = int(int(autorization_data['expires']) - time.time())
+    try:
+        db = db_helpers.get_database_connection()
+        db.set(TOKEN_REDIS_KEY, json.dumps(autorization_data),
+                                                ex=max(expires_in, 1))
+    except redis.RedisError:
+        logger.warning('Не удалось сохранить токен в Redis', exc_info=True)
+
+
+def _fetch_autorization():
+    '''
+    Получает новый токен. Если настроен Redis, токен делится между
+    процессами: обновляет его только тот, кто захватил блокировку,
+    остальные берут готовый.
+    '''
+    shared_data = _load_shared_autorization()
+    if is_token_fresh(shared_data):
+        return shared_data
+    if not db_helpers.is_database_configured():
+        return get_moltin_autorization()
+
+    db = db_helpers.get_database_connection()
+    shared_lock = db.lock(
+        TOKEN_REDIS_LOCK,
+        timeout=TOKEN_REDIS_LOCK_TIMEOUT,
+        blocking_timeout=TOKEN_REDIS_LOCK_TIMEOUT,
+    )
+    try:
+        lock_acquired = shared_lock.acquire()
+    except redis.RedisError:
+        logger.warning('Не удалось захватить блокировку в Redis',
+                                                            exc_info=True)
+        lock_acquired = False
+
+    try:
+        if lock_acquired:
+            shared_data = _load_shared_autorization()
+            if is_token_fresh(shared_data):
+                return shared_data
+        autorization_data = get_moltin_autorization()
+        _save_shared_autorization(autorization_data)
+        return autorization_data
+    finally:
+        if lock_acquired:
+            try:
+                shared_lock.release()
+            except redis.RedisError:
+                logger.warning('Не удалось снять блокировку в Redis',
+                                                            exc_info=True)
+
+
+def _refresh_autorization():
     global _moltin_autorization_data
-    if _moltin_autorization_data:
-        current_time = datetime.utcnow()
-        expires = int(_moltin_autorization_data['expires'])
-        expires = datetime.utcfromtimestamp(expires)
-        if current_time >= expires:
-            _moltin_autorization_data = get_moltin_autorization()
+    try:
+        _moltin_autorization_data = _fetch_autorization()
+    except requests.exceptions.RequestException:
+        if not is_token_fresh(_moltin_autorization_data, margin=0):
+            raise
+        logger.warning('Не удалось обновить токен, используем текущий',
+                                                            exc_info=True)
+        _schedule_token_refresh(TOKEN_RETRY_DELAY)
     else:
-        _moltin_autorization_data = get_moltin_autorization()
+        expires = int(_moltin_autorization_data['expires'])
+        _schedule_token_refresh(expires - TOKEN_REFRESH_MARGIN - time.time())
+
+
+def _schedule_token_refresh(delay):
+    global _token_refresh_timer
+    if _token_refresh_timer is not None:
+        _token_refresh_timer.cancel()
+    _token_refresh_timer = threading.Timer(
+        max(delay, 1),
+        _refresh_token_in_background,
+    )
+    _token_refresh_timer.daemon = True
+    _token_refresh_timer.start()
 
-    return f'{_moltin_autorization_data["token_type"]} '\
-            f'{_moltin_autorization_data["access_token"]}'
+
+def _refresh_token_in_background():
+    with _token_lock:
+        if is_token_fresh(_moltin_autorization_data):
+            return
+        try:
+            _refresh_autorization()
+        except requests.exceptions.RequestException:
+            logger.warning('Фоновое обновление токена не удалось',
+                                                            exc_info=True)
+
+
+def get_moltin_api_token():
+    '''
+    Токен обновляется заранее, в фоне, до истечения срока действия.
+    Если обновить его в фоне не успели, обновление выполняет только
+    один поток, остальные ждут его результата.
+    '''
+    autorization_data = _moltin_autorization_data
+    if not is_token_fresh(autorization_data):
+        with _token_lock:
+            if not is_token_fresh(_moltin_autorization_data):
+                _refresh_autorization()
+            autorization_data = _moltin_autorization_data
+
+    return f'{autorization_data["token_type"]} '\
+            f'{autorization_data["access_token"]}'
+
+
+def get_product_payload(product_data):
+    return {
+        'type': 'product',
+        'name': product_data['name'],
+        'slug': str(product_data['id']),
+        'sku': str(product_data['id']),
+        'description': product_data['description'],
+        'manage_stock': False,
+        'price': [
+            {
+                'amount': int(product_data['price'])*100,
+                'currency': 'RUB',
+                'includes_tax': True,
+            }
+        ],
+        'status': 'live',
+        'commodity_type': 'physical',
+    }
+
+
+def get_fingerprint(data, fields):
+    '''
+    Хеш значимых полей товара или записи: по нему синхронизация
+    понимает, изменилось ли что-то с прошлой загрузки.
+    '''
+    values = {field: data.get(field) for field in fields}
+    serialized = json.dumps(values, sort_keys=True, ensure_ascii=False)
+
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
 
 
 def create_product(product_data):
-    url = f'{BASE_URL}/products'
+    url = f'{get_base_url()}/products'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+        'Content-Type': 'application/json',
+    }
+    payload = {'data': get_product_payload(product_data)}
+    response = _make_request('POST', url, headers=headers, json=payload)
+    logger.debug(response.text)
+    response.raise_for_status()
+
+    return response.json()
+
+
+def update_product(product_id, product_data):
+    url = f'{get_base_url()}/products/{product_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
     payload = {
-        'data': { 
-            'type': 'product',
-            'name': product_data['name'],
-            'slug': str(product_data['id']),
-            'sku': str(product_data['id']),
-            'description': product_data['description'],
-            'manage_stock': False,
-            'price': [
-                {
-                    'amount': int(product_data['price'])*100,
-                    'currency': 'RUB',
-                    'includes_tax': True,
-                }
-            ],
-            'status': 'live',
-            'commodity_type': 'physical',
+        'data': {
+            'id': product_id,
+            **get_product_payload(product_data),
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('PUT', url, headers=headers, json=payload)
     logger.debug(response.text)
     response.raise_for_status()
 
@@ -81,43 +494,89 @@ def create_product(product_data):
 
 
 def get_products():
-    url = f'{BASE_URL}/products/'
+    url = f'{get_base_url()}/products/'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
+def iter_products(page_limit=PAGE_LIMIT, prefetch=True):
+    url = f'{get_base_url()}/products'
+    return iter_pages(url, page_limit, prefetch)
+
+
 def get_product(product_id):
-    url = f'{BASE_URL}/products/{product_id}'
+    url = f'{get_base_url()}/products/{product_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
+def normalize_product(product_data):
+    '''
+    Приводит ответ CMS о товаре к карточке, готовой для показа
+    пользователю. Ссылка на картинку берётся из included, если товар
+    запрошен с include=main_image.
+    '''
+    product = product_data['data']
+    display_price = product['meta']['display_price']['with_tax']['formatted']
+
+    image_id = None
+    image_link = None
+    main_image = product.get('relationships', {}).get('main_image')
+    if main_image and main_image.get('data'):
+        image_id = main_image['data']['id']
+    for image in product_data.get('included', {}).get('main_images', []):
+        if image['id'] == image_id:
+            image_link = image['link']['href']
+
+    return {
+        'id': product['id'],
+        'name': product['name'],
+        'description': product['description'],
+        'price': display_price,
+        'image_id': image_id,
+        'image_link': image_link,
+    }
+
+
+def get_product_card(product_id):
+    url = f'{get_base_url()}/products/{product_id}'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+        'Content-Type': 'application/json',
+    }
+    params = {'include': 'main_image'}
+    response = _make_request('GET', url, headers=headers, params=params)
+    response.raise_for_status()
+
+    return normalize_product(response.json())
+
+
 def delete_product(product_id):
-    url = f'{BASE_URL}/products/{product_id}'
+    url = f'{get_base_url()}/products/{product_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.delete(url, headers=headers)
+    response = _make_request('DELETE', url, headers=headers)
     response.raise_for_status()
 
     return response
 
 
 def create_main_image_relationship(product_id, image_id):
-    url = f'{BASE_URL}/products/{product_id}/relationships/main-image'
+    url = f'{get_base_url()}/products/{product_id}/relationships/main-image'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
@@ -127,48 +586,110 @@ def create_main_image_relationship(product_id, image_id):
             'id': image_id,
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
     response.raise_for_status()
 
     return response.json()
 
 
-def create_file(file_path, file_name):
-    url = f'{BASE_URL}/files'
+class MultipartFile:
+    '''
+    Тело запроса multipart/form-data с одним файлом, которое отдаётся
+    по мере чтения chunks, не собираясь в памяти целиком. Если размер
+    файла известен, requests отправит Content-Length, иначе тело уйдёт
+    с Transfer-Encoding: chunked.
+    '''
+    def __init__(self, chunks, file_name, content_type,
+                                        content_length=None, fields=None):
+        self.chunks = chunks
+        self.content_length = content_length
+        self.boundary = uuid.uuid4().hex
+        head = []
+        for name, value in (fields or {}).items():
+            head.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        head.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; '
+            f'filename="{file_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+        self.head = ''.join(head).encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __iter__(self):
+        yield self.head
+        for chunk in self.chunks:
+            if chunk:
+                yield chunk
+        yield self.tail
+
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        if self.content_length is None:
+            raise TypeError('Размер файла неизвестен')
+        return len(self.head) + self.content_length + len(self.tail)
+
+
+def create_file_from_stream(chunks, file_name, content_type,
+                                                        content_length=None):
+    '''
+    Загружает файл в CMS по частям. Прочитанный поток повторно
+    отправить нельзя, поэтому при ответе 429 запрос не повторяется:
+    вызывающий код должен открыть поток заново.
+    '''
+    url = f'{get_base_url()}/files'
+    body = MultipartFile(
+        chunks,
+        file_name,
+        content_type,
+        content_length,
+        fields={'public': 'true'},
+    )
     headers = {
         'Authorization': get_moltin_api_token(),
+        'Content-Type': body.content_type,
     }
-    files = {
-        'file': (file_name, open(file_path, 'rb')),
-        'public': True,
-    }
-
-    response = requests.post(url, headers=headers, files=files)
+    response = _make_request('POST', url, throttle_retries=0,
+                                                headers=headers, data=body)
     logger.debug(response.text)
     response.raise_for_status()
 
     return response.json()
 
 
-def get_all_files():
-    url = f'{BASE_URL}/files'
+def delete_file(file_id):
+    url = f'{get_base_url()}/files/{file_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
-        'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('DELETE', url, headers=headers)
     response.raise_for_status()
 
-    return response.json()
+    return response
+
+
+def iter_files(page_limit=PAGE_LIMIT, prefetch=True):
+    url = f'{get_base_url()}/files'
+    return iter_pages(url, page_limit, prefetch)
 
 
 def get_image_link(image_id):
-    url = f'{BASE_URL}/files/{image_id}'
+    url = f'{get_base_url()}/files/{image_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     file_data = response.json()
@@ -177,30 +698,30 @@ def get_image_link(image_id):
 
 
 def get_cart(cart_id):
-    url = f'{BASE_URL}/carts/{cart_id}'
+    url = f'{get_base_url()}/carts/{cart_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
 def delete_cart(cart_id):
-    url = f'{BASE_URL}/carts/{cart_id}'
+    url = f'{get_base_url()}/carts/{cart_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
-    response = requests.delete(url, headers=headers)
+    response = _make_request('DELETE', url, headers=headers)
     response.raise_for_status()
 
     return response
 
 
 def add_product_to_cart(cart_id, product_id, quantity=1):
-    url = f'{BASE_URL}/carts/{cart_id}/items'
+    url = f'{get_base_url()}/carts/{cart_id}/items'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
@@ -212,38 +733,64 @@ def add_product_to_cart(cart_id, product_id, quantity=1):
             'quantity': int(quantity),
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
+    response.raise_for_status()
+
+    return response.json()
+
+
+def add_products_to_cart(cart_id, products):
+    '''
+    Добавляет в корзину несколько товаров одним запросом.
+    products: {product_id: quantity}
+    '''
+    url = f'{get_base_url()}/carts/{cart_id}/items'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+        'Content-Type': 'application/json',
+    }
+    payload = {
+        'data': [
+            {
+                'id': product_id,
+                'type': 'cart_item',
+                'quantity': int(quantity),
+            }
+            for product_id, quantity in products.items()
+        ]
+    }
+    response = _make_request('POST', url, headers=headers, json=payload)
     response.raise_for_status()
 
     return response.json()
 
 
 def get_cart_items(cart_id):
-    url = f'{BASE_URL}/carts/{cart_id}/items'
+    url = f'{get_base_url()}/carts/{cart_id}/items'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
 def remove_cart_item(cart_id, item_id):
-    url = f'{BASE_URL}/carts/{cart_id}/items/{item_id}'
+    url = f'{get_base_url()}/carts/{cart_id}/items/{item_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
         }
-    response = requests.delete(url, headers=headers)
+    response = _make_request('DELETE', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
 def create_customer(customer_name, email):
-    url = f'{BASE_URL}/customers'
+    url = f'{get_base_url()}/customers'
     headers = {
         'Authorization': get_moltin_api_token(),
         'Content-Type': 'application/json',
@@ -255,14 +802,14 @@ def create_customer(customer_name, email):
             'email': email,
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
     response.raise_for_status()
 
     return response.json()
 
 
 def create_flow(name, description):
-    url = f'{BASE_URL}/flows'
+    url = f'{get_base_url()}/flows'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
@@ -275,15 +822,31 @@ def create_flow(name, description):
             'enabled': True,
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
     logger.debug(response.text)
     response.raise_for_status()
 
     return response.json()
 
 
+def iter_flows(page_limit=PAGE_LIMIT, prefetch=True):
+    url = f'{get_base_url()}/flows'
+    return iter_pages(url, page_limit, prefetch)
+
+
+def get_flow_fields(slug):
+    url = f'{get_base_url()}/flows/{slug}/fields'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+    }
+    response = _make_request('GET', url, headers=headers)
+    response.raise_for_status()
+
+    return response.json()
+
+
 def create_field(name, description, flow_id):
-    url = f'{BASE_URL}/fields'
+    url = f'{get_base_url()}/fields'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
@@ -306,7 +869,7 @@ def create_field(name, description, flow_id):
             },
         },
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
     logger.debug(response.text)
     response.raise_for_status()
 
@@ -315,14 +878,14 @@ def create_field(name, description, flow_id):
 
 def create_entry(flow_name, entry_data):
     slug = flow_name.lower().replace(' ', '_')
-    url = f'{BASE_URL}/flows/{slug}/entries'
+    url = f'{get_base_url()}/flows/{slug}/entries'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
     entry_data['type'] = 'entry'
     payload = {'data': entry_data}
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = _make_request('POST', url, headers=headers, json=payload)
     logger.debug(response.text)
     response.raise_for_status()
 
@@ -330,27 +893,62 @@ def create_entry(flow_name, entry_data):
 
 
 def get_all_entries(slug):
-    url = f'{BASE_URL}/flows/{slug}/entries'
+    url = f'{get_base_url()}/flows/{slug}/entries'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
+def iter_entries(slug, page_limit=PAGE_LIMIT, prefetch=True):
+    url = f'{get_base_url()}/flows/{slug}/entries'
+    return iter_pages(url, page_limit, prefetch)
+
+
 def get_an_entry(slug, entry_id):
-    url = f'{BASE_URL}/flows/{slug}/entries/{entry_id}'
+    url = f'{get_base_url()}/flows/{slug}/entries/{entry_id}'
     headers = {
         'Authorization': get_moltin_api_token(),
     }
 
-    response = requests.get(url, headers=headers)
+    response = _make_request('GET', url, headers=headers)
     response.raise_for_status()
 
     return response.json()
 
 
+def update_entry(slug, entry_id, entry_data):
+    url = f'{get_base_url()}/flows/{slug}/entries/{entry_id}'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+    }
+    payload = {
+        'data': {
+            'id': entry_id,
+            'type': 'entry',
+            **entry_data,
+        }
+    }
+    response = _make_request('PUT', url, headers=headers, json=payload)
+    logger.debug(response.text)
+    response.raise_for_status()
+
+    return response.json()
+
+
+def delete_entry(slug, entry_id):
+    url = f'{get_base_url()}/flows/{slug}/entries/{entry_id}'
+    headers = {
+        'Authorization': get_moltin_api_token(),
+    }
+    response = _make_request('DELETE', url, headers=headers)
+    response.raise_for_status()
+
+    return response
+
+
 if __name__ == '__main__':
     logger.error('Этот скрипт не предназначен для запуска напрямую')
\ No newline at end of file
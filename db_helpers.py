@@ -0,0 +1,32 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import os
+import logging
+import redis
+
+
+logger = logging.getLogger('db_helpers')
+
+_database = None
+
+
+def is_database_configured():
+    return bool(os.getenv('REDIS_HOST'))
+
+
+def get_database_connection():
+    global _database
+    if _database is None:
+        database_password = os.getenv('REDIS_PASSWORD')
+        database_host = os.getenv('REDIS_HOST')
+        database_port = os.getenv('REDIS_PORT')
+        _database = redis.Redis(
+                host=database_host,
+                port=database_port,
+                password=database_password,
+            )
+    return _database
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
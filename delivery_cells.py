@@ -0,0 +1,198 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+import os
+import threading
+
+from geopy import distance
+
+from cache_helpers import LRUCache
+
+
+logger = logging.getLogger('delivery_cells')
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+CELL_PRECISION = 7
+CELLS_CACHE_SIZE = 4096
+BOUNDARY = 'BOUNDARY'
+
+_delivery_cells = None
+_delivery_cells_lock = threading.Lock()
+
+
+def encode_geohash(latitude, longitude, precision=CELL_PRECISION):
+    latitude_range = [-90.0, 90.0]
+    longitude_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bits_count = 0
+    even_bit = True
+    while len(geohash) < precision:
+        if even_bit:
+            value, value_range = longitude, longitude_range
+        else:
+            value, value_range = latitude, latitude_range
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even_bit = not even_bit
+        bits_count += 1
+        if bits_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bits_count = 0
+    return ''.join(geohash)
+
+
+def get_geohash_bounds(geohash):
+    '''
+    Границы ячейки: (мин. широта, макс. широта, мин. долгота, макс. долгота).
+    '''
+    latitude_range = [-90.0, 90.0]
+    longitude_range = [-180.0, 180.0]
+    even_bit = True
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = longitude_range if even_bit else latitude_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if bits >> shift & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even_bit = not even_bit
+    return (*latitude_range, *longitude_range)
+
+
+class DeliveryCells:
+    '''
+    Ближайшая пиццерия и зона доставки по ячейкам geohash. Ячейка
+    запоминается, только если для любой её точки ответ одинаковый:
+    по неравенству треугольника расстояние от точки ячейки до пиццерии
+    отличается от расстояния до центра не больше, чем на радиус ячейки.
+    Ячейки на границе зон или между двумя пиццериями помечаются,
+    и для них всё считается точно. Кэш сбрасывается, когда меняются
+    пиццерии, DELIVERY_RADIUS или DELIVERY_PRICE.
+    '''
+    def __init__(self, precision=CELL_PRECISION, maxsize=CELLS_CACHE_SIZE):
+        self.precision = precision
+        self.cells = LRUCache(maxsize=maxsize)
+        self.version = None
+        self.boundary_hits = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, index, delivery_radius, delivery_price):
+        version = (
+            index.fingerprint,
+            tuple(sorted(delivery_radius.items())),
+            tuple(sorted(delivery_price.items())),
+        )
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.cells.clear()
+                    self.version = version
+                    logger.debug('Кэш зон доставки сброшен')
+
+    def _get_cell(self, geohash, index, get_delivery_area, delivery_radius):
+        '''
+        (id пиццерии, её координаты, (мин. расстояние, макс. расстояние),
+        зона) для всей ячейки или BOUNDARY.
+        '''
+        min_latitude, max_latitude, min_longitude, max_longitude = \
+                                                get_geohash_bounds(geohash)
+        center = (
+            (min_latitude + max_latitude) / 2,
+            (min_longitude + max_longitude) / 2,
+        )
+        cell_radius = max(
+            distance.distance(center, corner).km
+            for corner in (
+                (min_latitude, min_longitude),
+                (min_latitude, max_longitude),
+                (max_latitude, min_longitude),
+                (max_latitude, max_longitude),
+            )
+        )
+
+        nearest = index.get_nearest(center, 2)
+        pizzeria, distance_to_pizzeria = nearest[0]
+        if (len(nearest) > 1
+                and nearest[1][1] - distance_to_pizzeria <= 2 * cell_radius):
+            return BOUNDARY
+
+        band = (
+            max(distance_to_pizzeria - cell_radius, 0),
+            distance_to_pizzeria + cell_radius,
+        )
+        if any(band[0] <= radius <= band[1]
+                                    for radius in delivery_radius.values()):
+            return BOUNDARY
+        return (
+            pizzeria['id'],
+            (float(pizzeria['latitude']), float(pizzeria['longitude'])),
+            band,
+            get_delivery_area(distance_to_pizzeria, delivery_radius),
+        )
+
+    def get(self, location, index, get_delivery_area, delivery_radius,
+                                                            delivery_price):
+        '''
+        (id пиццерии, расстояние в км, зона доставки) для location.
+        get_delivery_area(расстояние, delivery_radius) определяет зону.
+        '''
+        self._check_version(index, delivery_radius, delivery_price)
+        latitude, longitude = map(float, location)
+        geohash = encode_geohash(latitude, longitude, self.precision)
+
+        cell = self.cells.get(geohash)
+        if cell is None:
+            cell = self._get_cell(geohash, index, get_delivery_area,
+                                                            delivery_radius)
+            self.cells.set(geohash, cell)
+
+        if cell == BOUNDARY:
+            with self._lock:
+                self.boundary_hits += 1
+            pizzeria, distance_to_pizzeria = index.get_nearest(location)[0]
+            return (
+                pizzeria['id'],
+                distance_to_pizzeria,
+                get_delivery_area(distance_to_pizzeria, delivery_radius),
+            )
+
+        # Из ячейки известны пиццерия и зона, а расстояние, которое
+        # видит пользователь, считаем точно: это одно измерение вместо
+        # поиска по индексу.
+        pizzeria_id, pizzeria_location, _, delivery_area = cell
+        distance_to_pizzeria = distance.distance(
+            (latitude, longitude),
+            pizzeria_location,
+        ).km
+        return pizzeria_id, distance_to_pizzeria, delivery_area
+
+    def get_stats(self):
+        stats = self.cells.get_stats()
+        stats['precision'] = self.precision
+        stats['boundary_hits'] = self.boundary_hits
+        return stats
+
+
+def get_delivery_cells():
+    global _delivery_cells
+    if _delivery_cells is None:
+        with _delivery_cells_lock:
+            if _delivery_cells is None:
+                _delivery_cells = DeliveryCells(
+                    precision=int(os.getenv('DELIVERY_CELL_PRECISION',
+                                                            CELL_PRECISION)),
+                )
+    return _delivery_cells
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,211 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+
+logger = logging.getLogger('delivery_zones')
+
+EARTH_RADIUS = 6371.0088
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+MATRIX_CELLS = 2_000_000
+METHODS = ('haversine', 'vincenty')
+
+
+def to_array(locations):
+    '''
+    [(широта, долгота), ...] -> массив N×2 в радианах.
+    '''
+    return np.radians(np.asarray(locations, dtype=float).reshape(-1, 2))
+
+
+def get_haversine_matrix(locations, store_locations):
+    latitudes = locations[:, 0][:, np.newaxis]
+    longitudes = locations[:, 1][:, np.newaxis]
+    store_latitudes = store_locations[:, 0][np.newaxis, :]
+    store_longitudes = store_locations[:, 1][np.newaxis, :]
+
+    haversine = (
+        np.sin((store_latitudes - latitudes) / 2) ** 2
+        + np.cos(latitudes) * np.cos(store_latitudes)
+        * np.sin((store_longitudes - longitudes) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(haversine, 0, 1)))
+
+
+def get_vincenty_matrix(locations, store_locations):
+    '''
+    Обратная задача Винсенти на эллипсоиде WGS-84 сразу для всех пар.
+    Для почти диаметрально противоположных точек, где итерации
+    не сходятся, берётся расстояние по формуле гаверсинусов.
+    '''
+    latitudes = locations[:, 0][:, np.newaxis]
+    longitudes = locations[:, 1][:, np.newaxis]
+    store_latitudes = store_locations[:, 0][np.newaxis, :]
+    store_longitudes = store_locations[:, 1][np.newaxis, :]
+
+    reduced = np.arctan((1 - WGS84_F) * np.tan(latitudes))
+    store_reduced = np.arctan((1 - WGS84_F) * np.tan(store_latitudes))
+    sin_u1, cos_u1 = np.sin(reduced), np.cos(reduced)
+    sin_u2, cos_u2 = np.sin(store_reduced), np.cos(store_reduced)
+    longitude_difference = np.broadcast_to(
+        store_longitudes - longitudes,
+        (len(locations), len(store_locations)),
+    )
+
+    lambda_ = longitude_difference.copy()
+    converged = np.zeros(lambda_.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(VINCENTY_ITERATIONS):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(
+                cos_u2 * sin_lambda,
+                cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda,
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma == 0,
+                0,
+                cos_u1 * cos_u2 * sin_lambda / sin_sigma,
+            )
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(
+                cos2_alpha == 0,
+                0,
+                cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha,
+            )
+            c = WGS84_F / 16 * cos2_alpha * (
+                4 + WGS84_F * (4 - 3 * cos2_alpha)
+            )
+            previous_lambda = lambda_
+            lambda_ = longitude_difference + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (
+                    cos_2sigma_m + c * cos_sigma * (
+                        -1 + 2 * cos_2sigma_m ** 2
+                    )
+                )
+            )
+            converged = np.abs(lambda_ - previous_lambda) < VINCENTY_TOLERANCE
+            if converged.all():
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = b * sin_sigma * (
+        cos_2sigma_m + b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2)
+            * (-3 + 4 * cos_2sigma_m ** 2)
+        )
+    )
+    distances = WGS84_B * a * (sigma - delta_sigma)
+
+    if not converged.all():
+        logger.debug(f'Формула Винсенти не сошлась для '
+                                        f'{np.count_nonzero(~converged)} пар')
+        distances = np.where(
+            converged,
+            distances,
+            get_haversine_matrix(locations, store_locations),
+        )
+    return distances
+
+
+def get_distance_matrix(locations, store_locations, method='haversine'):
+    '''
+    Расстояния в км от каждого адреса до каждой пиццерии: матрица N×M.
+    locations и store_locations: [(широта, долгота), ...] в градусах.
+    '''
+    if method not in METHODS:
+        raise ValueError(f'Неизвестный способ расчёта расстояний: {method}')
+    locations = to_array(locations)
+    store_locations = to_array(store_locations)
+    if method == 'vincenty':
+        return get_vincenty_matrix(locations, store_locations)
+    return get_haversine_matrix(locations, store_locations)
+
+
+def get_delivery_areas(distances, delivery_radius):
+    '''
+    Зоны доставки для массива расстояний. Границы те же, что в
+    ext_helpers.get_delivery_area: расстояние, в точности равное
+    радиусу зоны, тоже считается FAR_AWAY.
+    '''
+    conditions = (
+        distances < delivery_radius['SHORT'],
+        (delivery_radius['SHORT'] < distances)
+            & (distances < delivery_radius['MIDDLE']),
+        (delivery_radius['MIDDLE'] < distances)
+            & (distances < delivery_radius['LONG']),
+    )
+    return np.select(conditions, ('SHORT', 'MIDDLE', 'LONG'), 'FAR_AWAY')
+
+
+def _classify_chunk(locations, store_locations, delivery_radius, method):
+    distances = get_distance_matrix(locations, store_locations, method)
+    nearest = distances.argmin(axis=1)
+    nearest_distances = distances[np.arange(len(nearest)), nearest]
+
+    return (
+        nearest,
+        nearest_distances,
+        get_delivery_areas(nearest_distances, delivery_radius),
+    )
+
+
+def classify_locations(locations, pizzerias, delivery_radius,
+                        method='haversine', workers=None, chunk_size=None):
+    '''
+    Для каждого адреса из locations находит ближайшую пиццерию
+    и зону доставки: [(id пиццерии, расстояние в км, зона)].
+    Адреса обрабатываются частями по chunk_size строк, чтобы матрица
+    расстояний не разрасталась; с workers части считаются
+    в отдельных процессах.
+    '''
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
+    store_locations = np.array([
+        (float(pizzeria['latitude']), float(pizzeria['longitude']))
+        for pizzeria in pizzerias
+    ])
+    if not len(store_locations):
+        raise ValueError('Список пиццерий пуст')
+    if chunk_size is None:
+        chunk_size = max(1, MATRIX_CELLS // len(store_locations))
+    chunks = [
+        locations[start:start + chunk_size]
+        for start in range(0, len(locations), chunk_size)
+    ]
+    arguments = (
+        chunks,
+        repeat(store_locations),
+        repeat(delivery_radius),
+        repeat(method),
+    )
+    if workers and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_classify_chunk, *arguments))
+    else:
+        results = list(map(_classify_chunk, *arguments))
+
+    classified = []
+    for nearest, nearest_distances, areas in results:
+        classified.extend(
+            (pizzerias[index]['id'], float(distance_to_pizzeria), str(area))
+            for index, distance_to_pizzeria, area
+            in zip(nearest, nearest_distances, areas)
+        )
+    return classified
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
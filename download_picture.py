@@ -12,68 +12,312 @@ import requests
 import os
 import sys
 import argparse
+import json
 import logging
 import textwrap
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger('download_picture')
 
+DOWNLOAD_TIMEOUT = (3.05, 30)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_WORKERS = 8
+STATE_FILE = '.downloads.json'
+
+_session = None
+_session_lock = threading.Lock()
 
-def download_picture(url, directory='images', filename=None):
+
+def get_session(pool_size=DEFAULT_WORKERS):
     '''
-    Функция принимает на вход url картинки и путь, куда её сохранить, 
-    а затем скачивает эту картинку.
+    Общая сессия с пулом keep-alive соединений для всех загрузок.
     '''
-    logger.debug(url)
-    logger.debug(directory)
-    logger.debug(filename)
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                max_retries = Retry(
+                    total=3,
+                    backoff_factor=0.3,
+                    status_forcelist=(500, 502, 503, 504),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=pool_size,
+                    max_retries=max_retries,
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
 
+def get_file_path(url, directory='images', filename=None):
     network_filename = url.split('/')[-1]
     extension = network_filename.split('.')[-1]
 
     if filename == None:
         filename = network_filename.split('.')[-2]
 
-    file_path = f'{directory}/{filename}.{extension}'
+    return f'{directory}/{filename}.{extension}'
+
+
+def load_download_state(directory):
+    '''
+    Размеры и ETag уже скачанных файлов: {имя файла: {...}}.
+    '''
+    try:
+        with open(os.path.join(directory, STATE_FILE), 'r') as state_file:
+            return json.load(state_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_download_state(directory, state):
+    state_path = os.path.join(directory, STATE_FILE)
+    with open(f'{state_path}.part', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(f'{state_path}.part', state_path)
 
-    logger.debug(file_path)
 
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    response = requests.get(url, verify=False)
-    response.raise_for_status()
+def is_unchanged(response, file_path, known_file):
+    if not known_file or not os.path.exists(file_path):
+        return False
+    if response.status_code == 304:
+        return True
+    etag = response.headers.get('ETag')
+    if etag and known_file.get('etag'):
+        return etag == known_file['etag']
+    size = response.headers.get('Content-Length')
+    return (size is not None
+                and int(size) == known_file.get('size')
+                == os.path.getsize(file_path))
 
-    with open(file_path, 'wb') as file:
-        file.write(response.content)
 
-    logger.info(f'скачан файл {file_path}')
+def fetch_picture(url, file_path, verify=True, state=None):
+    '''
+    Скачивает картинку по частям во временный файл .part и заменяет
+    им file_path, когда загрузка завершена. Если размер и ETag
+    картинки не изменились с прошлой загрузки, файл не скачивается.
+    Возвращает число скачанных байт или None, если файл пропущен.
+    '''
+    if state is None:
+        state = {}
+    file_name = os.path.basename(file_path)
+    known_file = state.get(file_name)
+    headers = {}
+    if known_file and known_file.get('etag') and os.path.exists(file_path):
+        headers['If-None-Match'] = known_file['etag']
+
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    session = get_session()
+    with session.get(url, headers=headers, stream=True,
+                        timeout=DOWNLOAD_TIMEOUT, verify=verify) as response:
+        if is_unchanged(response, file_path, known_file):
+            logger.debug(f'файл {file_path} не изменился')
+            return None
+        response.raise_for_status()
+
+        part_path = f'{file_path}.part'
+        downloaded = 0
+        try:
+            with open(part_path, 'wb') as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    downloaded += len(chunk)
+            os.replace(part_path, file_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+        state[file_name] = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'size': downloaded,
+        }
+
+    return downloaded
+
+
+def download_picture(url, directory='images', filename=None, verify=True):
+    '''
+    Функция принимает на вход url картинки и путь, куда её сохранить,
+    а затем скачивает эту картинку.
+    '''
+    logger.debug(url)
+    logger.debug(directory)
+    logger.debug(filename)
+
+    file_path = get_file_path(url, directory, filename)
+
+    logger.debug(file_path)
+
+    if fetch_picture(url, file_path, verify) is None:
+        logger.info(f'файл {file_path} не изменился, пропущен')
+    else:
+        logger.info(f'скачан файл {file_path}')
 
     return file_path
- 
+
+
+def open_picture(url, verify=True):
+    '''
+    Открывает картинку для чтения по частям через iter_content(),
+    не загружая её в память целиком. Ответ нужно закрыть после чтения.
+    '''
+    logger.debug(url)
+    response = get_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                                                verify=verify)
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        response.close()
+        raise
+
+    return response
+
+
+def read_manifest(manifest_path):
+    '''
+    Список картинок для пакетной загрузки: [(url, имя файла или None)].
+    Принимает файл со ссылками по одной в строке, JSON-список ссылок
+    или menu.json: картинки товаров сохраняются как product_img_<id>.
+    '''
+    with open(manifest_path, 'r') as manifest_file:
+        content = manifest_file.read()
+    try:
+        records = json.loads(content)
+    except ValueError:
+        records = [
+            line.strip() for line in content.splitlines()
+            if line.strip() and not line.startswith('#')
+        ]
+
+    pictures = []
+    for record in records:
+        if isinstance(record, dict):
+            pictures.append((
+                record['product_image']['url'],
+                f'product_img_{record["id"]}',
+            ))
+        else:
+            pictures.append((record, None))
+
+    return pictures
+
+
+def download_pictures(pictures, directory='images', workers=DEFAULT_WORKERS,
+                                                                verify=True):
+    '''
+    Скачивает картинки в workers потоков и возвращает сводку:
+    сколько скачано, пропущено без изменений и не скачано из-за ошибок.
+    '''
+    get_session(pool_size=workers)
+    state = load_download_state(directory)
+    summary = {'downloaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    summary_lock = threading.Lock()
+    started_at = time.monotonic()
+
+    def download(picture):
+        url, filename = picture
+        file_path = get_file_path(url, directory, filename)
+        try:
+            downloaded = fetch_picture(url, file_path, verify, state)
+        except (requests.exceptions.RequestException, OSError) as error:
+            logger.error(f'не удалось скачать {url}: {error}')
+            result = 'failed'
+            downloaded = 0
+        else:
+            result = 'skipped' if downloaded is None else 'downloaded'
+            logger.debug(f'{file_path}: {result}')
+        with summary_lock:
+            summary[result] += 1
+            summary['bytes'] += downloaded or 0
+
+    os.makedirs(directory, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(download, pictures))
+    finally:
+        save_download_state(directory, state)
+    summary['seconds'] = time.monotonic() - started_at
+
+    return summary
+
+
+def print_summary(summary):
+    seconds = summary['seconds'] or 1e-9
+    processed = summary['downloaded'] + summary['skipped'] + summary['failed']
+    megabytes = summary['bytes'] / 1024 / 1024
+    print(f'Скачано: {summary["downloaded"]}, '
+          f'без изменений: {summary["skipped"]}, '
+          f'ошибок: {summary["failed"]}')
+    print(f'Получено {megabytes:.1f} МБ за {seconds:.1f} сек.: '
+          f'{processed / seconds:.1f} файлов/сек., '
+          f'{megabytes / seconds:.2f} МБ/сек.')
+
 
 def main():
     logging.basicConfig(
-        format = u'%(levelname)s [LINE:%(lineno)d]#  %(message)s', 
+        format = u'%(levelname)s [LINE:%(lineno)d]#  %(message)s',
         level = logging.DEBUG
     )
 
     description='''
-        Программа принимает на вход url картинки, 
-        директорию, куда её сохранить и опционально имя файла, 
-        а затем скачивает эту картинку
+        Программа принимает на вход url картинки,
+        директорию, куда её сохранить и опционально имя файла,
+        а затем скачивает эту картинку.
+        С ключом --manifest скачивает сразу все картинки из списка
+        или из menu.json
         '''
 
     parser = argparse.ArgumentParser(
         description=textwrap.dedent(description),
         )
-    parser.add_argument('url', help='ссылка на картинку')
-    parser.add_argument('directory', help='куда сохранять')
+    parser.add_argument('url', nargs='?', help='ссылка на картинку')
+    parser.add_argument('directory', nargs='?', help='куда сохранять')
     parser.add_argument('-n', '--filename', help='имя файла')
+    parser.add_argument('-m', '--manifest',
+                        help='файл со ссылками по одной в строке, '
+                             'JSON-список ссылок или menu.json')
+    parser.add_argument('-o', '--output', default='images',
+                        help='куда сохранять картинки из --manifest')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='сколько картинок скачивать одновременно')
+    parser.add_argument('--insecure', action='store_true',
+                        help='не проверять SSL-сертификат сервера')
     args = parser.parse_args()
 
+    if args.manifest:
+        if args.url:
+            parser.error('с ключом --manifest ссылка не указывается')
+        summary = download_pictures(
+            read_manifest(args.manifest),
+            args.output,
+            args.workers,
+            verify=not args.insecure,
+        )
+        print_summary(summary)
+        if summary['failed']:
+            sys.exit(1)
+        return
+
+    if not args.url or not args.directory:
+        parser.error('укажите ссылку на картинку и директорию')
     try:
-        download_picture(args.url, args.directory, args.filename)
-    except HTTPError:
-        logging.error('HTTPError: Not Found', exc_info=True)
+        download_picture(args.url, args.directory, args.filename,
+                                                verify=not args.insecure)
+    except (requests.exceptions.RequestException, OSError):
+        logging.error(f'не удалось скачать {args.url}', exc_info=True)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,35 +4,24 @@ __author__ = 'ArkJzzz (arkjzzz@gmail.com)'
 
 import os
 import logging
-import redis
 import requests
 import json
 import textwrap
 
 from telegram import LabeledPrice
-from geopy import distance
 
-import cms_helpers
+import cache_helpers
+import delivery_cells
+import gazetteer
 import keyboards
+import pizzeria_registry
+from db_helpers import get_database_connection
 
 
 logger = logging.getLogger('ext_helpers')
 
-_database = None
-
-
-def get_database_connection():
-    global _database
-    if _database is None:
-        database_password = os.getenv('REDIS_PASSWORD')
-        database_host = os.getenv('REDIS_HOST')
-        database_port = os.getenv('REDIS_PORT')
-        _database = redis.Redis(
-                host=database_host,
-                port=database_port,
-                password=database_password,
-            )
-    return _database
+GEOCODER_TIMEOUT = (3.05, 10)
+GEOCODERS = 'gazetteer,yandex'
 
 
 def fetch_coordinates_from_address(place):
@@ -43,7 +32,7 @@ def fetch_coordinates_from_address(place):
         'sco': 'longlat', 
         'format': 'json',
     }
-    response = requests.get(base_url, params=params)
+    response = requests.get(base_url, params=params, timeout=GEOCODER_TIMEOUT)
     response.raise_for_status()
     response = response.json()
     places_found = response['response']['GeoObjectCollection']['featureMember']
@@ -52,6 +41,47 @@ def fetch_coordinates_from_address(place):
         return most_relevant['GeoObject']['Point']['pos']
 
 
+def fetch_coordinates_from_gazetteer(place):
+    return gazetteer.get_gazetteer().query(place)
+
+
+def fetch_coordinates_from_yandex(place):
+    return cache_helpers.get_coordinates(place, fetch_coordinates_from_address)
+
+
+GEOCODER_BACKENDS = {
+    'gazetteer': fetch_coordinates_from_gazetteer,
+    'yandex': fetch_coordinates_from_yandex,
+}
+
+
+def get_geocoders():
+    '''
+    Геокодеры в порядке опроса из переменной окружения GEOCODERS,
+    например 'gazetteer' для работы без доступа к Яндексу.
+    '''
+    names = os.getenv('GEOCODERS', GEOCODERS).split(',')
+    geocoders = []
+    for name in filter(None, map(str.strip, names)):
+        if name not in GEOCODER_BACKENDS:
+            raise ValueError(f'Неизвестный геокодер: {name}')
+        geocoders.append(GEOCODER_BACKENDS[name])
+    return geocoders
+
+
+def fetch_coordinates(place):
+    '''
+    Опрашивает геокодеры по очереди: локальный справочник адресов
+    отвечает сразу, а Яндекс-геокодер спрашивается, только если
+    адреса в справочнике нет.
+    '''
+    for geocoder in get_geocoders():
+        location = geocoder(place)
+        if location:
+            logger.debug(f'{geocoder.__name__}: {place} -> {location}')
+            return location
+
+
 def extract_coordinates(message):
     logger.debug('extract_coordinates')
     
@@ -64,30 +94,13 @@ def extract_coordinates(message):
 
     elif message.text:
         logger.debug(f'message.text: {message.text}')
-        location = fetch_coordinates_from_address(message.text)
+        location = fetch_coordinates(message.text)
         if location:
             lon, lat = location.split(' ')
             logger.debug(f'location: lat {lat}, lon {lon}')
             return (lat, lon)
 
 
-def get_nearest_pizzeria(user_location):
-    pizzerias = cms_helpers.get_all_entries('pizzeria')
-    distance_to_pizzerias = []
-    for pizzeria in pizzerias['data']:
-        pizzeria_location = (pizzeria['latitude'], pizzeria['longitude'])
-        distance_to_pizzeria = distance.distance(
-                user_location, 
-                pizzeria_location,
-            ).km
-        distance_to_pizzerias.append((pizzeria['id'], distance_to_pizzeria))
-
-    def get_distance(distance_to_pizzeria):
-        return distance_to_pizzeria[1]
-
-    return min(distance_to_pizzerias, key=get_distance)
-
-
 def get_delivery_area(distance_to_pizzeria, delivery_radius):
     if distance_to_pizzeria < delivery_radius['SHORT']:
         return 'SHORT'
@@ -106,6 +119,21 @@ def get_delivery_area(distance_to_pizzeria, delivery_radius):
         return 'FAR_AWAY'
 
 
+def get_delivery_option(user_location, delivery_radius, delivery_price):
+    '''
+    Ближайшая пиццерия и зона доставки: (id пиццерии, расстояние в км,
+    зона). Для соседних адресов ответ берётся из кэша ячеек geohash.
+    '''
+    registry = pizzeria_registry.get_registry()
+    return delivery_cells.get_delivery_cells().get(
+        user_location,
+        registry.get_index(),
+        get_delivery_area,
+        delivery_radius,
+        delivery_price,
+    )
+
+
 def get_labeled_prices(cart_items, delivery_price=None):
     prices = []
     for item in cart_items['data']:
@@ -158,16 +186,12 @@ def format_cart(cart_items):
     return formatting_for_markdown(formated_cart)
 
 
-def format_product_info(product_data):
-    product_data = product_data['data']
-    product_meta = product_data['meta']
-    display_price = product_meta['display_price']['with_tax']['formatted']
-
+def format_product_info(product_card):
     formated_info = f'''
-            *{product_data['name']}*
-            {product_data['description']}
+            *{product_card['name']}*
+            {product_card['description']}
 
-            _Цена: {display_price}_
+            _Цена: {product_card['price']}_
         '''
     formated_info = textwrap.dedent(formated_info)
     formated_info = formatting_for_markdown(formated_info)
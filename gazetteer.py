@@ -0,0 +1,216 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+import os
+import threading
+
+from bisect import bisect_left
+from collections import Counter
+
+import json_stream
+from cache_helpers import normalize_address
+
+
+logger = logging.getLogger('gazetteer')
+
+GAZETTEER_FILE = 'static/addresses.json'
+MIN_PREFIX_LENGTH = 3
+MIN_SIMILARITY = 0.6
+STOP_WORDS = {'г', 'город', 'д', 'дом'}
+STREET_TYPES = {
+    'ул': 'улица',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'наб': 'набережная',
+    'ш': 'шоссе',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'пр-д': 'проезд',
+    'пл': 'площадь',
+    'пер': 'переулок',
+}
+STREET_TYPE_WORDS = set(STREET_TYPES.values())
+BUILDING_PARTS = {
+    'к': 'к',
+    'корп': 'к',
+    'корпус': 'к',
+    'стр': 'стр',
+    'строение': 'стр',
+    'вл': 'вл',
+    'владение': 'вл',
+}
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def parse_address(address):
+    '''
+    Адрес -> (слова без номера дома, номер дома). Сокращения типов
+    улиц раскрываются, а номер дома собирается в одну строку:
+    «ул. Профсоюзная, д. 152 корп. 2» -> ({профсоюзная, улица}, 152к2).
+    '''
+    words = []
+    house = []
+    building_part = ''
+    for word in normalize_address(address).split():
+        if any(char.isdigit() for char in word):
+            house.append(building_part + word)
+            building_part = ''
+        elif word in BUILDING_PARTS:
+            building_part = BUILDING_PARTS[word]
+        elif word not in STOP_WORDS:
+            words.append(STREET_TYPES.get(word, word))
+    return frozenset(words), ''.join(house)
+
+
+def get_trigrams(words):
+    trigrams = set()
+    for word in words:
+        word = f' {word} '
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+class Gazetteer:
+    '''
+    Локальный справочник адресов. Точное совпадение ищется по словарю,
+    недописанные слова дополняются по отсортированному списку слов,
+    а опечатки прощает поиск по триграммам. Номер дома при этом
+    должен совпадать в точности, чтобы не перепутать соседние дома.
+    '''
+    def __init__(self, records=()):
+        self.keys = []
+        self.locations = []
+        self.key_ids = {}
+        self.trigrams = []
+        self.postings = {}
+        for record in records:
+            self._add(record)
+        self.words = {word for words, _ in self.keys for word in words}
+        self.vocabulary = sorted(self.words)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add_key(self, key, location):
+        key_id = self.key_ids.get(key)
+        if key_id is not None:
+            if self.locations[key_id] != location:
+                # Один и тот же адрес в разных городах: без города
+                # по нему нельзя однозначно найти координаты.
+                self.locations[key_id] = None
+            return
+
+        key_id = len(self.keys)
+        self.key_ids[key] = key_id
+        self.keys.append(key)
+        self.locations.append(location)
+        trigrams = get_trigrams(key[0])
+        self.trigrams.append(trigrams)
+        for trigram in trigrams:
+            self.postings.setdefault(trigram, set()).add(key_id)
+
+    def _add(self, record):
+        '''
+        Запись в формате static/addresses.json: адрес, необязательное
+        название места и координаты {'lat': ..., 'lon': ...}.
+        '''
+        address = record['address']
+        if isinstance(address, dict):
+            city = address.get('city')
+            address = address['full']
+        else:
+            city = record.get('city')
+        coordinates = record['coordinates']
+        location = f'{coordinates["lon"]} {coordinates["lat"]}'
+
+        # Город и тип улицы часто не пишут: «Мичуринский 36».
+        words, house = parse_address(address)
+        city_words, _ = parse_address(city or '')
+        for variant in (words, words - city_words):
+            self._add_key((variant, house), location)
+            self._add_key((variant - STREET_TYPE_WORDS, house), location)
+        if record.get('alias'):
+            self._add_key(parse_address(record['alias']), location)
+
+    def _complete(self, word):
+        if len(word) < MIN_PREFIX_LENGTH:
+            return word
+        position = bisect_left(self.vocabulary, word)
+        completions = []
+        for candidate in self.vocabulary[position:position + 2]:
+            if candidate.startswith(word):
+                completions.append(candidate)
+        if len(completions) == 1:
+            return completions[0]
+        return word
+
+    def _find_exact(self, words, house):
+        key_id = self.key_ids.get((words, house))
+        if key_id is None:
+            completed = frozenset(
+                word if word in self.words else self._complete(word)
+                for word in words
+            )
+            key_id = self.key_ids.get((completed, house))
+        if key_id is not None:
+            return self.locations[key_id]
+
+    def _find_similar(self, words, house):
+        trigrams = get_trigrams(words)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.postings.get(trigram, ()))
+
+        best_similarity, best_id = 0, None
+        for key_id, shared_count in shared.items():
+            if self.keys[key_id][1] != house:
+                continue
+            similarity = shared_count / (
+                len(trigrams) + len(self.trigrams[key_id]) - shared_count
+            )
+            if similarity > best_similarity:
+                best_similarity, best_id = similarity, key_id
+        if best_id is not None and best_similarity >= MIN_SIMILARITY:
+            return self.locations[best_id]
+
+    def query(self, address):
+        '''
+        Координаты адреса в виде 'долгота широта', как у Яндекс-геокодера,
+        или None, если адреса нет в справочнике. Без номера дома ищутся
+        только точные совпадения, например название торгового центра.
+        '''
+        words, house = parse_address(address)
+        if not words:
+            return None
+        location = self._find_exact(words, house)
+        if location is None and house:
+            location = self._find_similar(words, house)
+        return location
+
+
+def load_gazetteer(path):
+    try:
+        gazetteer = Gazetteer(json_stream.iter_records(path))
+    except FileNotFoundError:
+        logger.warning(f'Справочник адресов {path} не найден')
+        return Gazetteer()
+    logger.debug(f'Загружен справочник адресов {path}: {len(gazetteer)}')
+    return gazetteer
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _gazetteer_lock:
+            if _gazetteer is None:
+                _gazetteer = load_gazetteer(
+                    os.getenv('GAZETTEER_FILE', GAZETTEER_FILE)
+                )
+    return _gazetteer
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
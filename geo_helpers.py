@@ -0,0 +1,165 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import hashlib
+import heapq
+import logging
+import math
+import threading
+
+from geopy import distance
+
+
+logger = logging.getLogger('geo_helpers')
+
+NEAREST_CANDIDATES = 4
+
+_pizzeria_index = None
+_pizzeria_index_lock = threading.Lock()
+
+
+def to_unit_vector(latitude, longitude):
+    '''
+    Точка на единичной сфере. Хорда между такими точками растёт вместе
+    с расстоянием по поверхности, поэтому ближайшая по хорде точка
+    будет ближайшей и на сфере.
+    '''
+    latitude = math.radians(float(latitude))
+    longitude = math.radians(float(longitude))
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def get_squared_distance(point, other_point):
+    return sum((a - b) ** 2 for a, b in zip(point, other_point))
+
+
+class KDTree:
+    '''
+    KD-дерево над трёхмерными точками. Узел: (точка, объект, ось,
+    левое поддерево, правое поддерево).
+    '''
+    def __init__(self, points, items):
+        self.size = len(points)
+        self.root = self._build(list(zip(points, items)), depth=0)
+
+    def _build(self, entries, depth):
+        if not entries:
+            return None
+        axis = depth % 3
+        entries.sort(key=lambda entry: entry[0][axis])
+        median = len(entries) // 2
+        point, item = entries[median]
+        return (
+            point,
+            item,
+            axis,
+            self._build(entries[:median], depth + 1),
+            self._build(entries[median + 1:], depth + 1),
+        )
+
+    def query(self, point, k=1):
+        '''
+        k ближайших к point объектов: [(квадрат расстояния, объект)],
+        по возрастанию расстояния.
+        '''
+        nearest = []
+        counter = 0
+
+        def search(node):
+            nonlocal counter
+            if node is None:
+                return
+            node_point, item, axis, left, right = node
+            squared_distance = get_squared_distance(point, node_point)
+            counter += 1
+            if len(nearest) < k:
+                heapq.heappush(nearest, (-squared_distance, counter, item))
+            elif squared_distance < -nearest[0][0]:
+                heapq.heapreplace(nearest, (-squared_distance, counter, item))
+
+            difference = point[axis] - node_point[axis]
+            near, far = (left, right) if difference < 0 else (right, left)
+            search(near)
+            if len(nearest) < k or difference ** 2 < -nearest[0][0]:
+                search(far)
+
+        search(self.root)
+
+        return sorted(
+            (-negative_distance, item)
+            for negative_distance, _, item in nearest
+        )
+
+
+def get_pizzerias_fingerprint(pizzerias):
+    pizzerias_hash = hashlib.sha1()
+    for pizzeria in sorted(pizzerias, key=lambda pizzeria: pizzeria['id']):
+        pizzerias_hash.update(
+            f'{pizzeria["id"]}:{pizzeria["latitude"]}:'
+            f'{pizzeria["longitude"]};'.encode('utf-8')
+        )
+    return pizzerias_hash.hexdigest()
+
+
+class PizzeriaIndex:
+    '''
+    Пространственный индекс пиццерий. Кандидатов подбирает KD-дерево
+    на единичной сфере, а точное расстояние по эллипсоиду geopy
+    считается только для нескольких найденных кандидатов.
+    '''
+    def __init__(self, pizzerias):
+        self.fingerprint = get_pizzerias_fingerprint(pizzerias)
+        points = [
+            to_unit_vector(pizzeria['latitude'], pizzeria['longitude'])
+            for pizzeria in pizzerias
+        ]
+        self.tree = KDTree(points, pizzerias)
+
+    def __len__(self):
+        return self.tree.size
+
+    def get_nearest(self, location, k=1):
+        '''
+        k ближайших к location пиццерий: [(пиццерия, расстояние в км)].
+        '''
+        latitude, longitude = location
+        candidates = self.tree.query(
+            to_unit_vector(latitude, longitude),
+            k + NEAREST_CANDIDATES - 1,
+        )
+        nearest = [
+            (
+                pizzeria,
+                distance.distance(
+                    (float(latitude), float(longitude)),
+                    (float(pizzeria['latitude']),
+                                        float(pizzeria['longitude'])),
+                ).km,
+            )
+            for _, pizzeria in candidates
+        ]
+        nearest.sort(key=lambda candidate: candidate[1])
+
+        return nearest[:k]
+
+
+def get_pizzeria_index(pizzerias):
+    '''
+    Индекс строится заново, только если изменился список пиццерий
+    или их координаты.
+    '''
+    global _pizzeria_index
+    fingerprint = get_pizzerias_fingerprint(pizzerias)
+    with _pizzeria_index_lock:
+        if (_pizzeria_index is None
+                or _pizzeria_index.fingerprint != fingerprint):
+            _pizzeria_index = PizzeriaIndex(pizzerias)
+            logger.debug(f'Построен индекс пиццерий: {len(_pizzeria_index)}')
+        return _pizzeria_index
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
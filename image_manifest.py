@@ -0,0 +1,122 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger('image_manifest')
+
+
+class HashingStream:
+    '''
+    Пропускает через себя части файла и считает хеш содержимого,
+    чтобы не читать файл ещё раз после загрузки.
+    '''
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self._hash.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class ImageManifest:
+    '''
+    Локальный список уже загруженных в CMS картинок:
+    urls   — {url картинки: хеш её содержимого},
+    files  — {хеш содержимого: {'id': id файла в CMS, 'link': ссылка}}.
+    По нему картинка, которая уже есть в CMS, привязывается к товару
+    без скачивания и повторной загрузки.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.urls = {}
+        self.files = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            return self
+        except ValueError:
+            logger.warning(f'Файл {self.path} повреждён, картинки будут '
+                                                    f'загружены заново')
+            return self
+        self.urls = manifest.get('urls', {})
+        self.files = manifest.get('files', {})
+        logger.debug(f'Загружен список картинок: {len(self.files)} шт.')
+
+        return self
+
+    def save(self):
+        with self._lock:
+            manifest = {'urls': dict(self.urls), 'files': dict(self.files)}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def validate(self, cms_files):
+        '''
+        Убирает из списка файлы, которых больше нет в CMS.
+        cms_files: файлы из cms_helpers.iter_files()
+        '''
+        cms_file_ids = {cms_file['id'] for cms_file in cms_files}
+        with self._lock:
+            stale_hashes = {
+                content_hash for content_hash, image_file in self.files.items()
+                if image_file['id'] not in cms_file_ids
+            }
+            for content_hash in stale_hashes:
+                del self.files[content_hash]
+            self.urls = {
+                url: content_hash for url, content_hash in self.urls.items()
+                if content_hash in self.files
+            }
+        if stale_hashes:
+            logger.warning(f'В CMS не найдено {len(stale_hashes)} картинок '
+                                    f'из списка, они будут загружены заново')
+
+        return len(stale_hashes)
+
+    def get_lock(self, key):
+        '''
+        Не даёт двум потокам одновременно загружать одну и ту же картинку.
+        '''
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get_file_by_url(self, url):
+        with self._lock:
+            content_hash = self.urls.get(url)
+            return self.files.get(content_hash)
+
+    def get_file_by_hash(self, content_hash):
+        with self._lock:
+            return self.files.get(content_hash)
+
+    def remember(self, url, content_hash, image_file):
+        with self._lock:
+            self.urls[url] = content_hash
+            self.files[content_hash] = {
+                'id': image_file['id'],
+                'link': image_file['link'],
+            }
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,99 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger('import_journal')
+
+
+class ImportJournal:
+    '''
+    Журнал загрузки каталога: по строке JSON на каждый завершённый шаг,
+    например {"step": "product", "key": "20", "id": "..."}.
+    Запись дописывается на диск сразу после шага, поэтому после падения
+    скрипта можно продолжить загрузку с того места, где она прервалась.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.steps = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as journal_file:
+                for line_number, line in enumerate(journal_file, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f'{self.path}:{line_number}: '
+                                        f'недописанная запись пропущена')
+                        continue
+                    self.steps[(record['step'], record['key'])] = record
+        except FileNotFoundError:
+            pass
+        logger.info(f'В журнале {len(self.steps)} завершённых шагов')
+
+        return self
+
+    def open(self, resume=False):
+        '''
+        Без resume журнал начинается заново.
+        '''
+        if not resume:
+            self.steps = {}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._file = open(self.path, 'a' if resume else 'w')
+        if resume and self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+        return self
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b'\n'
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def get(self, step, key):
+        with self._lock:
+            return self.steps.get((step, str(key)))
+
+    def is_done(self, step, key):
+        return self.get(step, key) is not None
+
+    def record(self, step, key, **data):
+        record = {'step': step, 'key': str(key), **data}
+        with self._lock:
+            self.steps[(step, record['key'])] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        return record
+
+    def update(self, step, key, **data):
+        '''
+        Записывает шаг, только если в журнале его нет или он записан
+        с другими данными, чтобы повторные синхронизации не раздували
+        журнал.
+        '''
+        record = self.get(step, key)
+        if record is not None and record == {'step': step, 'key': str(key),
+                                                                    **data}:
+            return record
+        return self.record(step, key, **data)
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
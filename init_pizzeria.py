@@ -2,15 +2,28 @@
 __author__ = 'ArkJzzz (arkjzzz@gmail.com)'
 
 
+import argparse
 import logging
-import json
+import mimetypes
 import os
+import textwrap
+import threading
+import time
 import requests
 
+from collections import Counter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from dotenv import load_dotenv
 
+import cache_helpers
 import cms_helpers
-from download_picture import download_picture
+import image_manifest
+import import_journal
+import json_stream
+import rate_limit
+import download_picture
 
 
 logger = logging.getLogger('init_pizzeria')
@@ -18,31 +31,475 @@ logger = logging.getLogger('init_pizzeria')
 MENU_FILE = 'static/menu.json'
 ADDRESSES_FILE = 'static/addresses.json'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGES_DIR = os.path.join(BASE_DIR, 'images')
+MANIFEST_FILE = os.path.join(IMAGES_DIR, 'manifest.json')
+JOURNAL_FILE = os.path.join(BASE_DIR, 'import_journal.jsonl')
+DEFAULT_WORKERS = 4
+IN_FLIGHT_PER_WORKER = 2
+IMAGE_CHUNK_SIZE = 64 * 1024
+PRODUCT_SYNC_FIELDS = (
+    'name',
+    'slug',
+    'sku',
+    'description',
+    'price',
+    'status',
+    'commodity_type',
+    'manage_stock',
+)
+PIZZERIA_SYNC_FIELDS = ('alias', 'address', 'latitude', 'longitude')
 
 
-def clear_catalogue():
-    products = cms_helpers.get_products()
-    for product in products['data']:
-        result = cms_helpers.delete_product(product["id"])
+class ImportProgress:
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get_throughput(self):
+        elapsed = time.monotonic() - self.started_at
+        return (self.done + self.failed) / elapsed if elapsed else 0
+
+    def update(self, succeeded=True):
+        with self._lock:
+            if succeeded:
+                self.done += 1
+            else:
+                self.failed += 1
+            processed = self.done + self.failed
+            total = f'/{self.total}' if self.total else ''
+            logger.info(f'{self.name}: {processed}{total}, '
+                        f'ошибок: {self.failed}, '
+                        f'{self.get_throughput():.1f} шт./сек.')
+
+    def report(self):
+        logger.info(f'{self.name}: готово {self.done}, ошибок {self.failed}, '
+                    f'{time.monotonic() - self.started_at:.1f} сек., '
+                    f'{self.get_throughput():.1f} шт./сек.')
+
+
+def map_bounded(pool, function, records, max_in_flight):
+    '''
+    Как pool.map, но следующая запись берётся из records, только когда
+    в работе меньше max_in_flight задач. Так файл читается по мере
+    загрузки, а не целиком заранее.
+    '''
+    in_flight = deque()
+    for record in records:
+        if len(in_flight) >= max_in_flight:
+            yield in_flight.popleft().result()
+        in_flight.append(pool.submit(function, record))
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def clear_catalogue(pool):
+    product_ids = [product['id'] for product in cms_helpers.iter_products()]
+    for result in pool.map(cms_helpers.delete_product, product_ids):
         logger.debug(result)
 
 
-def send_product_to_store(item):
-    try:
-        product = cms_helpers.create_product(item)
-        item_image_file = download_picture(
-            url=item['product_image']['url'], 
-            directory=os.path.join(BASE_DIR, 'images'), 
-            filename='product_img',
+def is_catalogue_cleared(journal):
+    '''
+    Очистка каталога считается незавершённой, если она началась
+    и не закончилась или если журнал пуст. В журналах прежних версий
+    скрипта записей об очистке нет, но товары в них уже есть.
+    '''
+    if journal.is_done('clear_catalogue', 'done'):
+        return True
+    return bool(len(journal)) and not journal.is_done('clear_catalogue',
+                                                                'started')
+
+
+def stream_product_image(item):
+    '''
+    Передаёт картинку из источника в CMS по частям, без временного
+    файла на диске. Возвращает хеш содержимого и ответ CMS.
+    '''
+    url = item['product_image']['url']
+    extension = url.split('/')[-1].split('.')[-1]
+    file_name = f'product_img_{item["id"]}.{extension}'
+    with download_picture.open_picture(url) as response:
+        content_length = response.headers.get('Content-Length')
+        if content_length is None or response.headers.get('Content-Encoding'):
+            content_length = None
+        else:
+            content_length = int(content_length)
+        content_type = response.headers.get(
+            'Content-Type',
+            mimetypes.guess_type(file_name)[0] or 'application/octet-stream',
         )
-        product_image = cms_helpers.create_file(item_image_file, 
-                                                            'product_img.jpeg')
-        product_id = product['data']['id']
-        product_image_id = product_image['data']['id']
-        cms_helpers.create_main_image_relationship(product_id, 
-                                                            product_image_id)
+        chunks = image_manifest.HashingStream(
+            response.iter_content(IMAGE_CHUNK_SIZE)
+        )
+        product_image = cms_helpers.create_file_from_stream(
+            chunks,
+            file_name,
+            content_type,
+            content_length,
+        )
+    logger.debug(f'{file_name}: {chunks.size} байт')
+
+    return chunks.hexdigest(), product_image
+
+
+def upload_product_image(item, pools, manifest):
+    '''
+    Возвращает файл картинки товара в CMS: {'id': ..., 'link': ...}.
+    Картинка, которая уже есть в manifest, не скачивается. Если
+    загруженная картинка совпала по содержимому с уже известной,
+    копия удаляется из CMS и используется известная.
+    '''
+    url = item['product_image']['url']
+    with manifest.get_lock(url):
+        image_file = manifest.get_file_by_url(url)
+        if image_file:
+            logger.debug(f'Картинка {url} уже загружена в CMS')
+            return image_file
+
+        for attempt in range(cms_helpers.THROTTLE_RETRIES + 1):
+            try:
+                content_hash, product_image = pools['uploads'].submit(
+                    stream_product_image,
+                    item,
+                ).result()
+                break
+            except requests.exceptions.HTTPError as error:
+                if (error.response.status_code != 429
+                        or attempt == cms_helpers.THROTTLE_RETRIES):
+                    raise
+                delay = rate_limit.get_retry_delay(error.response, attempt)
+                logger.warning(f'CMS ограничивает частоту запросов, '
+                            f'картинка {url} будет загружена заново '
+                            f'через {delay:.1f} сек.')
+                rate_limit.get_bucket().pause(delay)
+
+        uploaded_file = {
+            'id': product_image['data']['id'],
+            'link': product_image['data']['link']['href'],
+        }
+        with manifest.get_lock(content_hash):
+            image_file = manifest.get_file_by_hash(content_hash)
+            if image_file is None:
+                image_file = uploaded_file
+            else:
+                logger.debug(f'Картинка {url} совпадает с {image_file["id"]}')
+                cms_helpers.delete_file(uploaded_file['id'])
+            manifest.remember(url, content_hash, image_file)
+    cache_helpers.remember_image_link(image_file['id'], image_file['link'])
+
+    return image_file
+
+
+def create_product(item, journal):
+    product_record = journal.get('product', item['id'])
+    if product_record is None:
+        product = cms_helpers.create_product(item)
+        product_record = journal.record('product', item['id'],
+                                                    id=product['data']['id'])
+
+    return product_record['id']
+
+
+def get_product_image(item, pools, manifest, journal):
+    image_record = journal.get('image', item['id'])
+    if image_record is None:
+        image_file = upload_product_image(item, pools, manifest)
+        image_record = journal.record('image', item['id'], **image_file)
+
+    return image_record
+
+
+def send_product_to_store(item, pools, manifest, journal):
+    '''
+    Товар создаётся одновременно со скачиванием картинки, картинка
+    загружается в CMS сразу после скачивания, а связь товара с картинкой
+    создаётся, когда готово и то и другое. Шаги, уже записанные
+    в журнал, пропускаются.
+    '''
+    if journal.is_done('relationship', item['id']):
+        return
+    product = pools['products'].submit(create_product, item, journal)
+    try:
+        image_file = get_product_image(item, pools, manifest, journal)
+        product_id = product.result()
+        cms_helpers.create_main_image_relationship(product_id,
+                                                            image_file['id'])
+        journal.record('relationship', item['id'], product_id=product_id,
+                image_id=image_file['id'],
+                image_url=item['product_image']['url'])
     finally:
-        os.remove(item_image_file)
+        wait((product,))
+
+
+def import_menu(pizzeria_menu, pools, manifest, journal, workers):
+    progress = ImportProgress('Товары')
+
+    def import_item(item):
+        try:
+            send_product_to_store(item, pools, manifest, journal)
+        except Exception:
+            logger.exception(f'Не удалось загрузить товар {item["id"]}')
+            progress.update(succeeded=False)
+        else:
+            progress.update()
+
+    with ThreadPoolExecutor(max_workers=workers) as items_pool:
+        list(map_bounded(items_pool, import_item, pizzeria_menu,
+                                        workers * IN_FLIGHT_PER_WORKER))
+    progress.report()
+
+    return progress.failed
+
+
+def get_synced_image(item, main_image, pools, manifest, journal):
+    '''
+    Файл картинки для уже существующего товара. Если картинки нет
+    в manifest, а у товара уже есть main_image и адрес картинки
+    в menu.json не менялся с прошлого импорта, используется main_image:
+    без manifest иначе каждая синхронизация загружала бы все картинки
+    заново, оставляя в CMS старые файлы.
+    '''
+    url = item['product_image']['url']
+    image_file = manifest.get_file_by_url(url)
+    if image_file:
+        return image_file
+
+    relationship = journal.get('relationship', item['id']) or {}
+    if main_image and relationship.get('image_url', url) == url:
+        logger.debug(f'Картинка товара {item["id"]} уже загружена в CMS: '
+                                                    f'{main_image["id"]}')
+        return main_image
+
+    return upload_product_image(item, pools, manifest)
+
+
+def sync_menu(pizzeria_menu, pools, manifest, journal, workers):
+    '''
+    Сверяет каталог CMS с menu.json: товары сопоставляются по sku,
+    изменённые обновляются, новые создаются, лишние удаляются.
+    Возвращает количество изменений каждого вида.
+    '''
+    existing_products = {
+        product['sku']: product for product in cms_helpers.iter_products()
+    }
+    progress = ImportProgress('Товары')
+
+    def sync_item(item):
+        product = existing_products.pop(str(item['id']), None)
+        try:
+            if product is None:
+                send_product_to_store(item, pools, manifest, journal)
+                action = 'created'
+            else:
+                action = 'unchanged'
+                payload = cms_helpers.get_product_payload(item)
+                if (cms_helpers.get_fingerprint(product, PRODUCT_SYNC_FIELDS)
+                        != cms_helpers.get_fingerprint(payload,
+                                                    PRODUCT_SYNC_FIELDS)):
+                    cms_helpers.update_product(product['id'], item)
+                    action = 'updated'
+                relationships = product.get('relationships', {})
+                main_image = relationships.get('main_image', {}).get('data')
+                image_file = get_synced_image(item, main_image, pools,
+                                                        manifest, journal)
+                if not main_image or main_image['id'] != image_file['id']:
+                    cms_helpers.create_main_image_relationship(
+                        product['id'],
+                        image_file['id'],
+                    )
+                    action = 'updated'
+                journal.update('product', item['id'], id=product['id'])
+                journal.update('relationship', item['id'],
+                        product_id=product['id'], image_id=image_file['id'],
+                        image_url=item['product_image']['url'])
+        except Exception:
+            logger.exception(f'Не удалось синхронизировать товар {item["id"]}')
+            progress.update(succeeded=False)
+            return 'failed'
+        progress.update()
+        return action
+
+    with ThreadPoolExecutor(max_workers=workers) as items_pool:
+        changes = Counter(map_bounded(items_pool, sync_item, pizzeria_menu,
+                                        workers * IN_FLIGHT_PER_WORKER))
+
+    stale_product_ids = [
+        product['id'] for product in existing_products.values()
+    ]
+    for result in pools['products'].map(cms_helpers.delete_product,
+                                                        stale_product_ids):
+        logger.debug(result)
+    changes['deleted'] += len(stale_product_ids)
+    progress.report()
+    logger.info(f'Товары: {dict(changes)}')
+
+    return changes
+
+
+def create_fields(name, fields, flow_id, pool, journal):
+    slug = name.lower().replace(' ', '_')
+    progress = ImportProgress(f'Поля модели {name}', total=len(fields))
+
+    def create_field(field):
+        field_key = f'{slug}/{field.lower()}'
+        if journal.is_done('field', field_key):
+            progress.update()
+            return
+        try:
+            created_field = cms_helpers.create_field(
+                name=field,
+                description=f'{name} {field}',
+                flow_id=flow_id,
+            )
+        except requests.exceptions.RequestException:
+            logger.exception(f'Не удалось создать поле {field} '
+                                                        f'модели {name}')
+            progress.update(succeeded=False)
+            return
+        journal.record('field', field_key, id=created_field['data']['id'])
+        progress.update()
+
+    list(pool.map(create_field, fields))
+    progress.report()
+
+    return progress.failed
+
+
+def create_flow_with_fields(name, fields, pool, journal):
+    '''
+    Возвращает количество полей, которые не удалось создать.
+    '''
+    slug = name.lower().replace(' ', '_')
+    flow_record = journal.get('flow', slug)
+    if flow_record is None:
+        flow = cms_helpers.create_flow(name=name, description=name)
+        flow_record = journal.record('flow', slug, id=flow['data']['id'])
+    logger.debug(flow_record['id'])
+
+    return create_fields(name, fields, flow_record['id'], pool, journal)
+
+
+def sync_flow_with_fields(name, fields, pool, journal):
+    '''
+    Создаёт модель и её поля, только если их ещё нет в CMS.
+    '''
+    slug = name.lower().replace(' ', '_')
+    flows = {flow['slug']: flow for flow in cms_helpers.iter_flows()}
+    if slug not in flows:
+        return create_flow_with_fields(name, fields, pool, journal)
+
+    flow_id = flows[slug]['id']
+    journal.update('flow', slug, id=flow_id)
+    existing_fields = {
+        field['slug']: field['id']
+        for field in cms_helpers.get_flow_fields(slug)['data']
+    }
+    missing_fields = []
+    for field in fields:
+        field_id = existing_fields.get(field.lower().replace(' ', '_'))
+        if field_id is None:
+            missing_fields.append(field)
+        else:
+            journal.update('field', f'{slug}/{field.lower()}', id=field_id)
+    if missing_fields:
+        logger.info(f'{name}: добавляются поля {missing_fields}')
+
+    return create_fields(name, missing_fields, flow_id, pool, journal)
+
+
+def get_pizzeria_entry(pizzeria):
+    return {
+        'alias': pizzeria['alias'],
+        'address': pizzeria['address']['full'],
+        'latitude': pizzeria['coordinates']['lat'],
+        'longitude': pizzeria['coordinates']['lon'],
+    }
+
+
+def import_pizzerias(pizzeries, delivery_man, pool, journal, workers):
+    progress = ImportProgress('Пиццерии')
+
+    def create_pizzeria_entry(pizzeria):
+        entry_key = f'pizzeria/{pizzeria["alias"]}'
+        if journal.is_done('entry', entry_key):
+            progress.update()
+            return
+        entry_data = get_pizzeria_entry(pizzeria)
+        entry_data['delivery_man'] = delivery_man
+        try:
+            entry = cms_helpers.create_entry('Pizzeria', entry_data)
+        except Exception:
+            logger.exception(f'Не удалось загрузить пиццерию '
+                                                    f'{pizzeria["alias"]}')
+            progress.update(succeeded=False)
+        else:
+            journal.record('entry', entry_key, id=entry['data']['id'])
+            progress.update()
+
+    list(map_bounded(pool, create_pizzeria_entry, pizzeries,
+                                        workers * IN_FLIGHT_PER_WORKER))
+    progress.report()
+
+    return progress.failed
+
+
+def sync_pizzerias(pizzeries, delivery_man, pool, journal, workers):
+    '''
+    Сверяет записи пиццерий с addresses.json по alias. Курьер,
+    назначенный уже существующей пиццерии, не перезаписывается.
+    '''
+    existing_entries = {}
+    stale_entry_ids = []
+    for entry in cms_helpers.iter_entries('pizzeria'):
+        if entry.get('alias') in existing_entries:
+            stale_entry_ids.append(entry['id'])
+        else:
+            existing_entries[entry.get('alias')] = entry
+    progress = ImportProgress('Пиццерии')
+
+    def sync_pizzeria(pizzeria):
+        entry_data = get_pizzeria_entry(pizzeria)
+        entry = existing_entries.pop(pizzeria['alias'], None)
+        try:
+            if entry is None:
+                entry_data['delivery_man'] = delivery_man
+                entry = cms_helpers.create_entry('Pizzeria', entry_data)
+                entry = entry['data']
+                action = 'created'
+            elif (cms_helpers.get_fingerprint(entry, PIZZERIA_SYNC_FIELDS)
+                    != cms_helpers.get_fingerprint(entry_data,
+                                                    PIZZERIA_SYNC_FIELDS)):
+                cms_helpers.update_entry('pizzeria', entry['id'], entry_data)
+                action = 'updated'
+            else:
+                action = 'unchanged'
+            journal.update('entry', f'pizzeria/{pizzeria["alias"]}',
+                                                            id=entry['id'])
+        except Exception:
+            logger.exception(f'Не удалось синхронизировать пиццерию '
+                                                    f'{pizzeria["alias"]}')
+            progress.update(succeeded=False)
+            return 'failed'
+        progress.update()
+        return action
+
+    changes = Counter(map_bounded(pool, sync_pizzeria, pizzeries,
+                                        workers * IN_FLIGHT_PER_WORKER))
+
+    stale_entry_ids.extend(entry['id'] for entry in existing_entries.values())
+    for result in pool.map(lambda entry_id: cms_helpers.delete_entry(
+                                    'pizzeria', entry_id), stale_entry_ids):
+        logger.debug(result)
+    changes['deleted'] += len(stale_entry_ids)
+    progress.report()
+    logger.info(f'Пиццерии: {dict(changes)}')
+
+    return changes
+
 
 def main():
 
@@ -71,24 +528,70 @@ def main():
     download_picture_logger.addHandler(console_handler)
     download_picture_logger.setLevel(logging.DEBUG)
 
+    description = '''
+        Наполняет каталог Elastic Path товарами из menu.json
+        и создаёт модели пиццерий и адресов покупателей
+        '''
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent(description),
+        )
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='сколько товаров загружать одновременно')
+    parser.add_argument('-m', '--menu', default=MENU_FILE,
+                        help='меню: JSON-массив или JSON Lines (.jsonl)')
+    parser.add_argument('-a', '--addresses', default=ADDRESSES_FILE,
+                        help='адреса пиццерий: JSON-массив или JSON Lines '
+                             '(.jsonl)')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-s', '--sync', action='store_true',
+                        help='не очищать каталог, а изменить в нём только '
+                             'то, что отличается от menu.json '
+                             'и addresses.json')
+    mode.add_argument('-r', '--resume', action='store_true',
+                        help='продолжить прерванную загрузку, пропустив '
+                             'шаги, записанные в журнал')
+    args = parser.parse_args()
+
     load_dotenv()
+    rate_limit.set_default_priority(rate_limit.BULK)
+    # Без CMS_POOL_SIZE на каждый поток приходится по три соединения.
+    pool_size = int(os.getenv('CMS_POOL_SIZE', args.workers * 3))
+    cms_helpers.get_session(pool_size=pool_size)
+    download_picture.get_session(pool_size=args.workers)
     delivery_man = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
 
-    clear_catalogue()
-
-
-    try: 
-        with open(MENU_FILE, 'r') as menu_file:
-            pizzeria_menu = json.load(menu_file)
-        for item in pizzeria_menu:
-            send_product_to_store(item)
-
-        pizzeria_flow = cms_helpers.create_flow(
-                    name='Pizzeria',
-                    description='Pizzeria'
-                )
-        pizzeria_flow_id = pizzeria_flow['data']['id']
-        logger.debug(pizzeria_flow_id)
+    pools = {
+        'products': ThreadPoolExecutor(args.workers, 'products'),
+        'uploads': ThreadPoolExecutor(args.workers, 'uploads'),
+    }
+    manifest = image_manifest.ImageManifest(MANIFEST_FILE).load()
+    journal = import_journal.ImportJournal(JOURNAL_FILE)
+    # Синхронизация дописывает журнал, а не начинает его заново:
+    # после неё --resume тоже пропускает всё, что уже есть в CMS.
+    if args.resume or args.sync:
+        journal.load()
+    journal.open(resume=args.resume or args.sync)
+    failed = 0
+    try:
+        manifest.validate(cms_helpers.iter_files())
+        pizzeria_menu = json_stream.iter_records(args.menu)
+        if args.sync:
+            # Синхронизация не очищает каталог, и после неё очищать
+            # его при --resume тоже не нужно.
+            journal.update('clear_catalogue', 'done')
+            changes = sync_menu(pizzeria_menu, pools, manifest, journal,
+                                                                args.workers)
+            failed += changes['failed']
+            if changes['created'] or changes['updated'] or changes['deleted']:
+                cache_helpers.bump_catalogue_version()
+        else:
+            if not args.resume or not is_catalogue_cleared(journal):
+                journal.record('clear_catalogue', 'started')
+                clear_catalogue(pools['products'])
+                journal.record('clear_catalogue', 'done')
+            failed += import_menu(pizzeria_menu, pools, manifest, journal,
+                                                                args.workers)
+            cache_helpers.bump_catalogue_version()
 
         pizzeria_flow_fields = (
                 'Address',
@@ -97,31 +600,18 @@ def main():
                 'Latitude',
                 'Delivery_man',
             )
-        for field in pizzeria_flow_fields:
-            cms_helpers.create_field(
-                name=field, 
-                description=f'Pizzeria {field}',
-                flow_id=pizzeria_flow_id,
-            )
-
-        with open(ADDRESSES_FILE, 'r') as addresses_file:
-            pizzeries = json.load(addresses_file)
-        for pizzeria in pizzeries:
-            entry_data = {
-                'alias': pizzeria['alias'],
-                'address': pizzeria['address']['full'],
-                'latitude': pizzeria['coordinates']['lat'],
-                'longitude': pizzeria['coordinates']['lon'],
-                'delivery_man': delivery_man,
-            }
-            cms_helpers.create_entry('Pizzeria', entry_data)
-
-        customer_address_flow = cms_helpers.create_flow(
-                name='Customer Address',
-                description='Customer Address',
-            )
-        customer_address_flow_id = customer_address_flow['data']['id']
-        logger.debug(customer_address_flow_id)
+        pizzeries = json_stream.iter_records(args.addresses)
+        if args.sync:
+            failed += sync_flow_with_fields('Pizzeria', pizzeria_flow_fields,
+                                                pools['products'], journal)
+            changes = sync_pizzerias(pizzeries, delivery_man,
+                                pools['products'], journal, args.workers)
+            failed += changes['failed']
+        else:
+            failed += create_flow_with_fields('Pizzeria',
+                        pizzeria_flow_fields, pools['products'], journal)
+            failed += import_pizzerias(pizzeries, delivery_man,
+                                pools['products'], journal, args.workers)
 
         customer_address_flow_fields = (
                 'telegram_id',
@@ -129,16 +619,27 @@ def main():
                 'latitude',
                 'longitude',
             )
-        for field in customer_address_flow_fields:
-            cms_helpers.create_field(
-                name=field,
-                description=f'Customer Address {field}',
-                flow_id=customer_address_flow_id,
-            )
-
-    except:
-        logger.exception('')
+        if args.sync:
+            failed += sync_flow_with_fields('Customer Address',
+                    customer_address_flow_fields, pools['products'], journal)
+        else:
+            failed += create_flow_with_fields('Customer Address',
+                    customer_address_flow_fields, pools['products'], journal)
 
+    except (requests.exceptions.RequestException, OSError, ValueError):
+        logger.exception('Загрузка прервана. Чтобы продолжить её, '
+                                    'запустите скрипт с ключом --resume')
+    else:
+        if failed:
+            logger.warning(f'Не загружено объектов: {failed}. Чтобы '
+                    f'догрузить их, запустите скрипт с ключом --resume')
+        else:
+            logger.info('Загрузка завершена')
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+        manifest.save()
+        journal.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,99 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import json
+import logging
+import re
+
+
+logger = logging.getLogger('json_stream')
+
+READ_SIZE = 64 * 1024
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+WHITESPACE = re.compile(r'\s*')
+
+
+def iter_json_array(file, read_size=READ_SIZE):
+    '''
+    Читает JSON-массив из файла по частям и отдаёт его элементы
+    по одному, не загружая весь файл в память. В памяти держится
+    только текущий элемент и непрочитанный остаток блока.
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    expected = '['
+
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise ValueError('Файл закончился раньше, чем JSON-массив')
+            chunk = file.read(read_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+
+        char = buffer[position]
+        if expected == '[':
+            if char != '[':
+                raise ValueError(f'Ожидался JSON-массив, а не {char!r}')
+            position += 1
+            expected = 'value or ]'
+        elif char == ']' and expected != 'value':
+            return
+        elif expected == ', or ]':
+            if char != ',':
+                raise ValueError(f'Ожидалась запятая, а не {char!r}')
+            position += 1
+            expected = 'value'
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # Элемент считается прочитанным, только когда за ним в блоке
+            # видна запятая или скобка: иначе число 4. из конца блока
+            # на самом деле может оказаться числом 4.5e10.
+            if end is not None:
+                following = WHITESPACE.match(buffer, end).end()
+                if following < len(buffer) and buffer[following] in ',]':
+                    end_is_visible = True
+                else:
+                    end_is_visible = eof
+            if end is None or not end_is_visible:
+                chunk = file.read(read_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield record
+            position = end
+            expected = ', or ]'
+
+
+def iter_json_lines(file):
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as error:
+            raise ValueError(f'Строка {line_number}: {error}') from error
+
+
+def iter_records(path, read_size=READ_SIZE):
+    '''
+    Записи из JSON-массива или из файла JSON Lines (.jsonl, .ndjson),
+    по одной, по мере чтения файла.
+    '''
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith(JSON_LINES_EXTENSIONS):
+            yield from iter_json_lines(file)
+        else:
+            yield from iter_json_array(file, read_size)
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
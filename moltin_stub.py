@@ -0,0 +1,719 @@
+#!/usr/bin/python3
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+
+import argparse
+import json
+import logging
+import random
+import re
+import textwrap
+import threading
+import time
+import uuid
+
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+
+logger = logging.getLogger('moltin_stub')
+
+DEFAULT_PAGE_LIMIT = 25
+MAX_PAGE_LIMIT = 100
+TOKEN_LIFETIME = 3600
+CURRENCY = 'RUB'
+
+
+def format_price(amount):
+    return f'{amount // 100} ₽'
+
+
+def get_price(amount):
+    return {
+        'amount': amount,
+        'currency': CURRENCY,
+        'formatted': format_price(amount),
+    }
+
+
+def get_timestamps():
+    now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    return {'created_at': now, 'updated_at': now}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, title, detail=''):
+        super().__init__(title)
+        self.status = status
+        self.title = title
+        self.detail = detail
+
+
+class MoltinStore:
+    '''
+    Данные заглушки: товары, файлы, корзины, покупатели, модели и записи.
+    Хранятся в памяти процесса.
+    '''
+    def __init__(self, base_url, default_page_limit=DEFAULT_PAGE_LIMIT):
+        self.base_url = base_url
+        self.default_page_limit = default_page_limit
+        self.products = {}
+        self.files = {}
+        self.carts = {}
+        self.customers = {}
+        self.flows = {}
+        self.fields = {}
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    def paginate(self, records, query, url):
+        limit = int(query.get('page[limit]', self.default_page_limit))
+        limit = max(1, min(limit, MAX_PAGE_LIMIT))
+        offset = max(0, int(query.get('page[offset]', 0)))
+        total = len(records)
+        pages_total = max(1, -(-total // limit))
+        last_offset = (pages_total - 1) * limit
+
+        def get_link(link_offset):
+            return f'{url}?page[limit]={limit}&page[offset]={link_offset}'
+
+        links = {
+            'current': get_link(offset),
+            'first': get_link(0),
+            'last': get_link(last_offset),
+            'next': None,
+            'prev': None,
+        }
+        if offset + limit < total:
+            links['next'] = get_link(offset + limit)
+        if offset > 0:
+            links['prev'] = get_link(max(0, offset - limit))
+
+        return {
+            'data': records[offset:offset + limit],
+            'links': links,
+            'meta': {
+                'page': {
+                    'limit': limit,
+                    'offset': offset,
+                    'current': offset // limit + 1,
+                    'total': pages_total,
+                },
+                'results': {'total': total},
+            },
+        }
+
+    def build_product(self, product_data, product_id=None):
+        product_id = product_id or str(uuid.uuid4())
+        price = product_data.get('price') or [{'amount': 0}]
+        amount = int(price[0]['amount'])
+        product = {
+            'type': 'product',
+            'id': product_id,
+            'name': product_data.get('name', ''),
+            'slug': product_data.get('slug', product_id),
+            'sku': product_data.get('sku', product_id),
+            'manage_stock': product_data.get('manage_stock', False),
+            'description': product_data.get('description', ''),
+            'price': price,
+            'status': product_data.get('status', 'draft'),
+            'commodity_type': product_data.get('commodity_type', 'physical'),
+            'links': {'self': f'{self.base_url}/v2/products/{product_id}'},
+            'relationships': {},
+            'meta': {
+                'timestamps': get_timestamps(),
+                'display_price': {
+                    'with_tax': get_price(amount),
+                    'without_tax': get_price(amount),
+                },
+                'stock': {'level': 0, 'availability': 'out-stock'},
+            },
+        }
+        return product
+
+    def include_main_images(self, products, query):
+        if 'main_image' not in query.get('include', '').split(','):
+            return {}
+        main_images = []
+        for product in products:
+            main_image = product['relationships'].get('main_image')
+            if main_image and main_image['data']['id'] in self.files:
+                main_images.append(self.files[main_image['data']['id']])
+        return {'included': {'main_images': main_images}}
+
+    def get_cart(self, cart_id):
+        if cart_id not in self.carts:
+            self.carts[cart_id] = {
+                'id': cart_id,
+                'items': [],
+                'timestamps': get_timestamps(),
+            }
+        return self.carts[cart_id]
+
+    def build_cart_items(self, cart):
+        cart_amount = 0
+        items = []
+        for item in cart['items']:
+            product = self.products.get(item['product_id'], {})
+            price = product.get('price') or [{'amount': 0}]
+            unit_amount = int(price[0]['amount'])
+            value_amount = unit_amount * item['quantity']
+            cart_amount += value_amount
+            items.append({
+                'id': item['id'],
+                'type': 'cart_item',
+                'product_id': item['product_id'],
+                'name': product.get('name', ''),
+                'description': product.get('description', ''),
+                'sku': product.get('sku', ''),
+                'slug': product.get('slug', ''),
+                'quantity': item['quantity'],
+                'manage_stock': False,
+                'unit_price': {
+                    'amount': unit_amount,
+                    'currency': CURRENCY,
+                    'includes_tax': True,
+                },
+                'value': {
+                    'amount': value_amount,
+                    'currency': CURRENCY,
+                    'includes_tax': True,
+                },
+                'links': {
+                    'product': f'{self.base_url}/v2/products/'
+                                                    f'{item["product_id"]}',
+                },
+                'meta': {
+                    'display_price': {
+                        'with_tax': {
+                            'unit': get_price(unit_amount),
+                            'value': get_price(value_amount),
+                        },
+                        'without_tax': {
+                            'unit': get_price(unit_amount),
+                            'value': get_price(value_amount),
+                        },
+                    },
+                    'timestamps': get_timestamps(),
+                },
+            })
+
+        return {
+            'data': items,
+            'meta': {
+                'display_price': {
+                    'with_tax': get_price(cart_amount),
+                    'without_tax': get_price(cart_amount),
+                },
+                'timestamps': cart['timestamps'],
+            },
+        }
+
+    def add_cart_item(self, cart, item_data):
+        if item_data.get('type') != 'cart_item':
+            raise HTTPError(400, 'Bad Request', 'type must be cart_item')
+        product_id = item_data['id']
+        if product_id not in self.products:
+            raise HTTPError(404, 'Not Found', 'Product not found')
+        quantity = int(item_data.get('quantity', 1))
+        for item in cart['items']:
+            if item['product_id'] == product_id:
+                item['quantity'] += quantity
+                return
+        cart['items'].append({
+            'id': str(uuid.uuid4()),
+            'product_id': product_id,
+            'quantity': quantity,
+        })
+
+    def get_flow(self, slug):
+        for flow in self.flows.values():
+            if flow['slug'] == slug:
+                return flow
+        raise HTTPError(404, 'Not Found', f'Flow {slug} not found')
+
+
+class MoltinStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = []
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0], 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(chunk_size)
+                self.rfile.readline()
+        content_length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(content_length)
+
+    def read_json(self):
+        body = self.body
+        if not body:
+            raise HTTPError(400, 'Bad Request', 'Empty body')
+        try:
+            return json.loads(body)['data']
+        except (ValueError, KeyError):
+            raise HTTPError(400, 'Bad Request', 'Body must be {"data": ...}')
+
+    def read_form(self):
+        body = self.body
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {
+                key: values[0]
+                for key, values in parse_qs(body.decode('utf-8')).items()
+            }
+        message = BytesParser(policy=default_policy).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body
+        )
+        form = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            form[name] = {
+                'filename': part.get_filename(),
+                'content_type': part.get_content_type(),
+                'content': part.get_payload(decode=True),
+            }
+        return form
+
+    def send_json(self, status, payload=None):
+        body = b''
+        if payload is not None:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, title, detail='', headers=None):
+        payload = {
+            'errors': [{'status': status, 'title': title, 'detail': detail}],
+        }
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        options = self.server.options
+        url = urlsplit(self.path)
+        query = {
+            key: values[0] for key, values in parse_qs(url.query).items()
+        }
+        self.body = self.read_body()
+        if options['latency']:
+            time.sleep(random.uniform(0, 2 * options['latency']))
+
+        try:
+            if random.random() < options['error_rate']:
+                raise HTTPError(500, 'Internal Server Error')
+            if random.random() < options['throttle_rate']:
+                self.send_error_json(429, 'Too Many Requests',
+                                                headers={'Retry-After': '1'})
+                return
+            for route_method, pattern, handler in self.routes:
+                if route_method != method:
+                    continue
+                match = re.fullmatch(pattern, url.path)
+                if match:
+                    break
+            else:
+                raise HTTPError(404, 'Not Found', f'{method} {url.path}')
+
+            if not url.path.startswith('/oauth/'):
+                authorization = self.headers.get('Authorization', '')
+                if not authorization.startswith('Bearer '):
+                    raise HTTPError(401, 'Unauthorized',
+                                        'Unable to validate access token')
+            with self.store.lock:
+                status, payload = handler(self, query, *match.groups())
+        except HTTPError as error:
+            self.send_error_json(error.status, error.title, error.detail)
+            return
+        self.send_json(status, payload)
+
+    def create_token(self, query):
+        form = self.read_form()
+        if form.get('grant_type') != 'client_credentials':
+            raise HTTPError(422, 'Unprocessable Entity',
+                                            'Unsupported grant_type')
+        return 200, {
+            'expires': int(time.time()) + TOKEN_LIFETIME,
+            'identifier': 'client_credentials',
+            'expires_in': TOKEN_LIFETIME,
+            'access_token': uuid.uuid4().hex,
+            'token_type': 'Bearer',
+        }
+
+    def create_product(self, query):
+        product_data = self.read_json()
+        for product in self.store.products.values():
+            if product['sku'] == product_data.get('sku'):
+                raise HTTPError(409, 'Conflict', 'SKU already exists')
+        product = self.store.build_product(product_data)
+        self.store.products[product['id']] = product
+        return 201, {'data': product}
+
+    def get_products(self, query):
+        products = list(self.store.products.values())
+        page = self.store.paginate(products, query,
+                                            f'{self.store.base_url}/v2/products')
+        page.update(self.store.include_main_images(page['data'], query))
+        return 200, page
+
+    def get_product(self, query, product_id):
+        if product_id not in self.store.products:
+            raise HTTPError(404, 'Not Found', 'Product not found')
+        product = self.store.products[product_id]
+        payload = {'data': product}
+        payload.update(self.store.include_main_images([product], query))
+        return 200, payload
+
+    def update_product(self, query, product_id):
+        if product_id not in self.store.products:
+            raise HTTPError(404, 'Not Found', 'Product not found')
+        product_data = self.read_json()
+        for product in self.store.products.values():
+            if (product['id'] != product_id
+                    and product['sku'] == product_data.get('sku')):
+                raise HTTPError(409, 'Conflict', 'SKU already exists')
+        relationships = self.store.products[product_id]['relationships']
+        product = self.store.build_product(product_data, product_id)
+        product['relationships'] = relationships
+        self.store.products[product_id] = product
+        return 200, {'data': product}
+
+    def delete_product(self, query, product_id):
+        if self.store.products.pop(product_id, None) is None:
+            raise HTTPError(404, 'Not Found', 'Product not found')
+        return 204, None
+
+    def create_main_image_relationship(self, query, product_id):
+        if product_id not in self.store.products:
+            raise HTTPError(404, 'Not Found', 'Product not found')
+        relationship = self.read_json()
+        if relationship['id'] not in self.store.files:
+            raise HTTPError(404, 'Not Found', 'File not found')
+        self.store.products[product_id]['relationships']['main_image'] = {
+            'data': {'type': 'main_image', 'id': relationship['id']},
+        }
+        return 201, {'data': {'type': 'main_image', 'id': relationship['id']}}
+
+    def create_file(self, query):
+        form = self.read_form()
+        if 'file' not in form or not form['file'].get('filename'):
+            raise HTTPError(422, 'Unprocessable Entity', 'file is required')
+        file_id = str(uuid.uuid4())
+        file_name = form['file']['filename']
+        file_data = {
+            'type': 'file',
+            'id': file_id,
+            'file_name': file_name,
+            'mime_type': form['file']['content_type'],
+            'file_size': len(form['file']['content']),
+            'public': True,
+            'link': {
+                'href': f'{self.store.base_url}/files/{file_id}/{file_name}',
+            },
+            'links': {
+                'self': f'{self.store.base_url}/v2/files/{file_id}',
+            },
+            'meta': {
+                'dimensions': {'width': 0, 'height': 0},
+                'timestamps': get_timestamps(),
+            },
+        }
+        self.store.files[file_id] = file_data
+        return 201, {'data': file_data}
+
+    def get_files(self, query):
+        files = list(self.store.files.values())
+        return 200, self.store.paginate(files, query,
+                                            f'{self.store.base_url}/v2/files')
+
+    def get_file(self, query, file_id):
+        if file_id not in self.store.files:
+            raise HTTPError(404, 'Not Found', 'File not found')
+        return 200, {'data': self.store.files[file_id]}
+
+    def delete_file(self, query, file_id):
+        if self.store.files.pop(file_id, None) is None:
+            raise HTTPError(404, 'Not Found', 'File not found')
+        return 204, None
+
+    def get_cart(self, query, cart_id):
+        cart = self.store.get_cart(cart_id)
+        cart_items = self.store.build_cart_items(cart)
+        return 200, {
+            'data': {
+                'id': cart_id,
+                'type': 'cart',
+                'name': 'Cart',
+                'description': '',
+                'links': {'self': f'{self.store.base_url}/v2/carts/{cart_id}'},
+                'meta': cart_items['meta'],
+            },
+        }
+
+    def delete_cart(self, query, cart_id):
+        self.store.carts.pop(cart_id, None)
+        return 204, None
+
+    def add_cart_items(self, query, cart_id):
+        cart = self.store.get_cart(cart_id)
+        items_data = self.read_json()
+        if isinstance(items_data, dict):
+            items_data = [items_data]
+        for item_data in items_data:
+            self.store.add_cart_item(cart, item_data)
+        return 201, self.store.build_cart_items(cart)
+
+    def get_cart_items(self, query, cart_id):
+        cart = self.store.get_cart(cart_id)
+        return 200, self.store.build_cart_items(cart)
+
+    def remove_cart_item(self, query, cart_id, item_id):
+        cart = self.store.get_cart(cart_id)
+        cart['items'] = [
+            item for item in cart['items'] if item['id'] != item_id
+        ]
+        return 200, self.store.build_cart_items(cart)
+
+    def create_customer(self, query):
+        customer_data = self.read_json()
+        for customer in self.store.customers.values():
+            if customer['email'] == customer_data.get('email'):
+                raise HTTPError(409, 'Conflict', 'Email already exists')
+        customer = {
+            'type': 'customer',
+            'id': str(uuid.uuid4()),
+            'name': customer_data.get('name', ''),
+            'email': customer_data.get('email', ''),
+            'password': False,
+        }
+        self.store.customers[customer['id']] = customer
+        return 201, {'data': customer}
+
+    def create_flow(self, query):
+        flow_data = self.read_json()
+        for flow in self.store.flows.values():
+            if flow['slug'] == flow_data.get('slug'):
+                raise HTTPError(422, 'Unprocessable Entity',
+                                                    'Slug already exists')
+        flow_id = str(uuid.uuid4())
+        flow = {
+            'id': flow_id,
+            'type': 'flow',
+            'name': flow_data['name'],
+            'slug': flow_data['slug'],
+            'description': flow_data.get('description', ''),
+            'enabled': flow_data.get('enabled', True),
+            'links': {'self': f'{self.store.base_url}/v2/flows/{flow_id}'},
+            'relationships': {},
+            'meta': {'timestamps': get_timestamps()},
+        }
+        self.store.flows[flow_id] = flow
+        self.store.entries[flow['slug']] = {}
+        return 201, {'data': flow}
+
+    def get_flows(self, query):
+        flows = list(self.store.flows.values())
+        return 200, self.store.paginate(flows, query,
+                                            f'{self.store.base_url}/v2/flows')
+
+    def get_flow_fields(self, query, slug):
+        flow = self.store.get_flow(slug)
+        fields = [
+            field for field in self.store.fields.values()
+            if field['relationships']['flow']['data']['id'] == flow['id']
+        ]
+        return 200, {'data': fields}
+
+    def create_field(self, query):
+        field_data = self.read_json()
+        flow_id = field_data['relationships']['flow']['data']['id']
+        if flow_id not in self.store.flows:
+            raise HTTPError(404, 'Not Found', 'Flow not found')
+        field_id = str(uuid.uuid4())
+        field = dict(field_data, id=field_id)
+        field['meta'] = {'timestamps': get_timestamps()}
+        self.store.fields[field_id] = field
+        return 201, {'data': field}
+
+    def create_entry(self, query, slug):
+        flow = self.store.get_flow(slug)
+        entry_data = self.read_json()
+        entry = dict(entry_data, id=str(uuid.uuid4()), type='entry')
+        entry['meta'] = {'timestamps': get_timestamps()}
+        self.store.entries[flow['slug']][entry['id']] = entry
+        return 201, {'data': entry}
+
+    def get_entries(self, query, slug):
+        flow = self.store.get_flow(slug)
+        entries = list(self.store.entries[flow['slug']].values())
+        return 200, self.store.paginate(entries, query,
+                            f'{self.store.base_url}/v2/flows/{slug}/entries')
+
+    def get_entry(self, query, slug, entry_id):
+        flow = self.store.get_flow(slug)
+        entries = self.store.entries[flow['slug']]
+        if entry_id not in entries:
+            raise HTTPError(404, 'Not Found', 'Entry not found')
+        return 200, {'data': entries[entry_id]}
+
+    def update_entry(self, query, slug, entry_id):
+        flow = self.store.get_flow(slug)
+        entries = self.store.entries[flow['slug']]
+        if entry_id not in entries:
+            raise HTTPError(404, 'Not Found', 'Entry not found')
+        entry_data = self.read_json()
+        entry = dict(entries[entry_id], **entry_data)
+        entry.update(id=entry_id, type='entry')
+        entries[entry_id] = entry
+        return 200, {'data': entry}
+
+    def delete_entry(self, query, slug, entry_id):
+        flow = self.store.get_flow(slug)
+        if self.store.entries[flow['slug']].pop(entry_id, None) is None:
+            raise HTTPError(404, 'Not Found', 'Entry not found')
+        return 204, None
+
+
+MoltinStubHandler.routes = [
+    ('POST', r'/oauth/access_token', MoltinStubHandler.create_token),
+    ('POST', r'/v2/products', MoltinStubHandler.create_product),
+    ('GET', r'/v2/products/?', MoltinStubHandler.get_products),
+    ('GET', r'/v2/products/([^/]+)', MoltinStubHandler.get_product),
+    ('PUT', r'/v2/products/([^/]+)', MoltinStubHandler.update_product),
+    ('DELETE', r'/v2/products/([^/]+)', MoltinStubHandler.delete_product),
+    ('POST', r'/v2/products/([^/]+)/relationships/main-image',
+                            MoltinStubHandler.create_main_image_relationship),
+    ('POST', r'/v2/files', MoltinStubHandler.create_file),
+    ('GET', r'/v2/files/?', MoltinStubHandler.get_files),
+    ('GET', r'/v2/files/([^/]+)', MoltinStubHandler.get_file),
+    ('DELETE', r'/v2/files/([^/]+)', MoltinStubHandler.delete_file),
+    ('GET', r'/v2/carts/([^/]+)', MoltinStubHandler.get_cart),
+    ('DELETE', r'/v2/carts/([^/]+)', MoltinStubHandler.delete_cart),
+    ('POST', r'/v2/carts/([^/]+)/items', MoltinStubHandler.add_cart_items),
+    ('GET', r'/v2/carts/([^/]+)/items', MoltinStubHandler.get_cart_items),
+    ('DELETE', r'/v2/carts/([^/]+)/items/([^/]+)',
+                                        MoltinStubHandler.remove_cart_item),
+    ('POST', r'/v2/customers', MoltinStubHandler.create_customer),
+    ('POST', r'/v2/flows', MoltinStubHandler.create_flow),
+    ('GET', r'/v2/flows/?', MoltinStubHandler.get_flows),
+    ('GET', r'/v2/flows/([^/]+)/fields', MoltinStubHandler.get_flow_fields),
+    ('POST', r'/v2/fields', MoltinStubHandler.create_field),
+    ('POST', r'/v2/flows/([^/]+)/entries', MoltinStubHandler.create_entry),
+    ('GET', r'/v2/flows/([^/]+)/entries', MoltinStubHandler.get_entries),
+    ('GET', r'/v2/flows/([^/]+)/entries/([^/]+)',
+                                            MoltinStubHandler.get_entry),
+    ('PUT', r'/v2/flows/([^/]+)/entries/([^/]+)',
+                                            MoltinStubHandler.update_entry),
+    ('DELETE', r'/v2/flows/([^/]+)/entries/([^/]+)',
+                                            MoltinStubHandler.delete_entry),
+]
+
+
+def start_server(host='127.0.0.1', port=0, latency=0, error_rate=0,
+                    throttle_rate=0, page_limit=DEFAULT_PAGE_LIMIT):
+    '''
+    Запускает заглушку Elastic Path в фоновом потоке и возвращает сервер.
+    Адрес для cms_helpers.set_api_url() лежит в server.url, данные —
+    в server.store. Остановить: server.shutdown().
+    '''
+    server = ThreadingHTTPServer((host, port), MoltinStubHandler)
+    server.daemon_threads = True
+    server.url = f'http://{host}:{server.server_address[1]}'
+    server.store = MoltinStore(server.url, page_limit)
+    server.options = {
+        'latency': latency,
+        'error_rate': error_rate,
+        'throttle_rate': throttle_rate,
+    }
+    server_thread = threading.Thread(
+        target=server.serve_forever,
+        name='moltin_stub',
+        daemon=True,
+    )
+    server_thread.start()
+    logger.info(f'Заглушка Elastic Path запущена: {server.url}')
+
+    return server
+
+
+def main():
+    logging.basicConfig(
+        format = u'%(levelname)s [LINE:%(lineno)d]#  %(message)s',
+        level = logging.INFO
+    )
+
+    description = '''
+        Локальная заглушка API Elastic Path для тестов и замеров
+        без доступа к сети. Запустите её и укажите адрес в переменной
+        окружения ELASTICPATH_API_URL.
+        '''
+    parser = argparse.ArgumentParser(
+        description=textwrap.dedent(description),
+        )
+    parser.add_argument('--host', default='127.0.0.1', help='адрес')
+    parser.add_argument('--port', type=int, default=8080, help='порт')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='средняя задержка ответа, сек.')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='доля запросов, на которые отвечать 500')
+    parser.add_argument('--throttle-rate', type=float, default=0,
+                        help='доля запросов, на которые отвечать 429')
+    parser.add_argument('--page-limit', type=int, default=DEFAULT_PAGE_LIMIT,
+                        help='размер страницы по умолчанию')
+    args = parser.parse_args()
+
+    server = start_server(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        page_limit=args.page_limit,
+    )
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
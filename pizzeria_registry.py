@@ -0,0 +1,91 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+import os
+import threading
+import time
+
+import cache_helpers
+import geo_helpers
+
+
+logger = logging.getLogger('pizzeria_registry')
+
+REFRESH_INTERVAL = 300
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_refresh_interval():
+    return int(os.getenv('PIZZERIAS_REFRESH_INTERVAL', REFRESH_INTERVAL))
+
+
+class PizzeriaRegistry:
+    '''
+    Пиццерии в памяти процесса: адреса, координаты и курьеры по id
+    и пространственный индекс для поиска ближайшей. Загружается при
+    запуске бота и обновляется в фоне, поэтому обработчикам не нужно
+    запрашивать пиццерии в CMS.
+    '''
+    def __init__(self):
+        self.pizzerias = None
+        self.index = None
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        pizzerias = cache_helpers.get_pizzerias()
+        index = geo_helpers.get_pizzeria_index(pizzerias)
+        self.pizzerias = {pizzeria['id']: pizzeria for pizzeria in pizzerias}
+        self.index = index
+        self.refreshed_at = time.time()
+        logger.debug(f'Список пиццерий обновлён: {len(self.pizzerias)}')
+
+    def _load(self):
+        if self.pizzerias is None:
+            with self._lock:
+                if self.pizzerias is None:
+                    self.refresh()
+
+    def get(self, pizzeria_id):
+        self._load()
+        pizzeria = self.pizzerias.get(pizzeria_id)
+        if pizzeria is None:
+            logger.warning(f'Пиццерии {pizzeria_id} нет в списке, '
+                                                    f'запрашиваем её в CMS')
+            pizzeria = cache_helpers.get_pizzeria(pizzeria_id)
+        return pizzeria
+
+    def get_all(self):
+        self._load()
+        return list(self.pizzerias.values())
+
+    def get_index(self):
+        self._load()
+        return self.index
+
+    def get_nearest(self, location, count=1):
+        '''
+        count ближайших к location пиццерий: [(пиццерия, расстояние в км)].
+        '''
+        return self.get_index().get_nearest(location, count)
+
+    def get_stats(self):
+        return {
+            'pizzerias': len(self.pizzerias or {}),
+            'refreshed_at': self.refreshed_at,
+        }
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PizzeriaRegistry()
+    return _registry
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,278 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import logging
+import os
+import random
+import threading
+import time
+
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+import redis
+
+import db_helpers
+
+
+logger = logging.getLogger('rate_limit')
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {
+    INTERACTIVE: 'interactive',
+    BULK: 'bulk',
+}
+
+DEFAULT_RATE = 20
+DEFAULT_BURST = 20
+DEFAULT_BULK_RESERVE = 0.25
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+SHARED_BUCKET_KEY = 'cms_rate_limit:bucket'
+SHARED_PAUSE_KEY = 'cms_rate_limit:paused_until'
+
+# Общее для всех процессов ведро в Redis. Время берётся у Redis,
+# чтобы часы разных серверов не расходились. Запросы BULK получают
+# токен, только если после этого в ведре останется резерв для
+# запросов бота. Возвращает паузу в секундах, 0 — токен получен.
+ACQUIRE_SCRIPT = '''
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local paused_until = tonumber(redis.call('GET', KEYS[2]) or 0)
+if now < paused_until then
+    return tostring(paused_until - now)
+end
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local delay = 0
+if tokens >= 1 + reserve then
+    tokens = tokens - 1
+else
+    delay = (1 + reserve - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens),
+                                            'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(delay)
+'''
+PAUSE_SCRIPT = '''
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local delay = tonumber(ARGV[1])
+local paused_until = tonumber(redis.call('GET', KEYS[1]) or 0)
+if now + delay > paused_until then
+    redis.call('SET', KEYS[1], tostring(now + delay),
+                                'PX', math.ceil(delay * 1000) + 1000)
+end
+return 1
+'''
+
+_bucket = None
+_bucket_lock = threading.Lock()
+_default_priority = INTERACTIVE
+_local = threading.local()
+
+
+class TokenBucket:
+    '''
+    Ограничитель частоты запросов «ведро с токенами». Пока в очереди
+    ждёт запрос с более высоким приоритетом, запросы с низким
+    приоритетом токены не получают.
+
+    Если настроен Redis, бот и init_pizzeria.py берут токены ещё и из
+    общего ведра: так они вместе не превышают лимит CMS, а загрузка
+    каталога с приоритетом BULK оставляет боту резерв bulk_reserve
+    от ёмкости ведра. Если Redis недоступен, лимит считается только
+    внутри процесса.
+    '''
+    def __init__(self, rate, capacity, bulk_reserve=DEFAULT_BULK_RESERVE,
+                                                                shared=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.bulk_reserve = bulk_reserve * capacity
+        if shared is None:
+            shared = db_helpers.is_database_configured()
+        self.shared = shared
+        self._acquire_script = None
+        self._pause_script = None
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def _has_priority_waiters(self, priority):
+        return any(
+            waiting for waiting_priority, waiting in self._waiting.items()
+            if waiting_priority < priority
+        )
+
+    def acquire(self, priority=None):
+        if priority is None:
+            priority = get_priority()
+        started_at = time.monotonic()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now < self._paused_until:
+                        delay = self._paused_until - now
+                    elif self._has_priority_waiters(priority):
+                        delay = 1 / self.rate
+                    elif self._tokens < 1:
+                        delay = (1 - self._tokens) / self.rate
+                    else:
+                        self._tokens -= 1
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+        if self.shared:
+            self._acquire_shared(priority)
+        with self._condition:
+            self.acquired += 1
+            self.total_wait += time.monotonic() - started_at
+
+    def _register_scripts(self):
+        if self._acquire_script is None:
+            db = db_helpers.get_database_connection()
+            self._pause_script = db.register_script(PAUSE_SCRIPT)
+            self._acquire_script = db.register_script(ACQUIRE_SCRIPT)
+
+    def _acquire_shared(self, priority):
+        reserve = self.bulk_reserve if priority == BULK else 0
+        while True:
+            try:
+                self._register_scripts()
+                delay = float(self._acquire_script(
+                    keys=(SHARED_BUCKET_KEY, SHARED_PAUSE_KEY),
+                    args=(self.rate, self.capacity, reserve),
+                ))
+            except redis.RedisError:
+                logger.warning('Общий лимит запросов к CMS в Redis '
+                        'недоступен, считаем лимит внутри процесса',
+                        exc_info=True)
+                return
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def pause(self, delay):
+        with self._condition:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until,
+                                                time.monotonic() + delay)
+        if self.shared:
+            try:
+                self._register_scripts()
+                self._pause_script(keys=(SHARED_PAUSE_KEY,), args=(delay,))
+            except redis.RedisError:
+                logger.warning('Не удалось сохранить паузу запросов к CMS '
+                                            'в Redis', exc_info=True)
+
+    def get_stats(self):
+        with self._condition:
+            average_wait = 0
+            if self.acquired:
+                average_wait = self.total_wait / self.acquired
+            return {
+                'queue_depth': {
+                    PRIORITY_NAMES[priority]: waiting
+                    for priority, waiting in self._waiting.items()
+                },
+                'shared': self.shared,
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'average_wait': round(average_wait, 3),
+            }
+
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        with _bucket_lock:
+            if _bucket is None:
+                _bucket = TokenBucket(
+                    rate=float(os.getenv('CMS_RATE_LIMIT', DEFAULT_RATE)),
+                    capacity=float(os.getenv('CMS_RATE_BURST',
+                                                        DEFAULT_BURST)),
+                    bulk_reserve=float(os.getenv('CMS_BULK_RESERVE',
+                                                DEFAULT_BULK_RESERVE)),
+                )
+    return _bucket
+
+
+def set_default_priority(priority):
+    global _default_priority
+    _default_priority = priority
+
+
+def get_priority():
+    return getattr(_local, 'priority', _default_priority)
+
+
+class priority:
+    '''
+    Меняет приоритет запросов к CMS в текущем потоке:
+
+        with rate_limit.priority(rate_limit.BULK):
+            ...
+    '''
+    def __init__(self, priority):
+        self.priority = priority
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'priority', None)
+        _local.priority = self.priority
+
+    def __exit__(self, *exc_info):
+        if self._previous is None:
+            del _local.priority
+        else:
+            _local.priority = self._previous
+
+
+def get_retry_delay(response, attempt):
+    '''
+    Пауза перед повтором запроса, на который CMS ответила 429:
+    по заголовку Retry-After, а если его нет — экспоненциальная.
+    К паузе добавляется случайная добавка, чтобы воркеры
+    не повторяли запросы одновременно.
+    '''
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            retry_at = parsedate_to_datetime(retry_after)
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        delay = min(max(delay, 0), BACKOFF_MAX)
+        return delay + random.uniform(0, BACKOFF_BASE)
+
+    delay = min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+def get_stats():
+    return get_bucket().get_stats()
+
+
+if __name__ == '__main__':
+    logger.error('Этот скрипт не предназначен для запуска напрямую')
@@ -0,0 +1,173 @@
+__author__ = 'ArkJzzz (arkjzzz@gmail.com)'
+
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import cache_helpers
+import cart_helpers
+import cms_async
+import cms_helpers
+import image_manifest
+import import_journal
+import init_pizzeria
+import moltin_stub
+
+
+CHAT_ID = 100500
+PIZZAS_COUNT = 3
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def images_url(tmp_path_factory):
+    images_dir = tmp_path_factory.mktemp('images')
+    for number in range(PIZZAS_COUNT):
+        (images_dir / f'pizza{number}.jpg').write_bytes(
+            b'\xff\xd8\xff' + bytes([number]) * 1024,
+        )
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0),
+        functools.partial(QuietHandler, directory=str(images_dir)),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.fixture(scope='module')
+def cms(monkeypatch_module):
+    server = moltin_stub.start_server()
+    cms_helpers.set_api_url(server.url)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope='module')
+def monkeypatch_module():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.delenv('REDIS_HOST', raising=False)
+        monkeypatch.setenv('ELASTICPATH_CLIENT_ID', 'client_id')
+        monkeypatch.setenv('ELASTICPATH_CLIENT_SECRET', 'client_secret')
+        monkeypatch.setattr(cart_helpers, 'CART_DEBOUNCE', 60)
+        yield monkeypatch
+
+
+@pytest.fixture(scope='module')
+def menu(images_url):
+    return [
+        {
+            'id': number + 1,
+            'name': f'Пицца {number + 1}',
+            'description': 'Тестовая пицца',
+            'price': 300 + 100 * number,
+            'product_image': {'url': f'{images_url}/pizza{number}.jpg'},
+        }
+        for number in range(PIZZAS_COUNT)
+    ]
+
+
+@pytest.fixture(scope='module')
+def imported_menu(cms, menu, tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp('import')
+    manifest = image_manifest.ImageManifest(str(work_dir / 'manifest.json'))
+    journal = import_journal.ImportJournal(str(work_dir / 'journal.jsonl'))
+    journal.open(resume=False)
+    pools = {
+        'products': ThreadPoolExecutor(2, 'products'),
+        'uploads': ThreadPoolExecutor(2, 'uploads'),
+    }
+    try:
+        failed = init_pizzeria.import_menu(menu, pools, manifest, journal,
+                                                                workers=2)
+        failed += init_pizzeria.create_flow_with_fields(
+            'Customer Address',
+            ('telegram_id', 'phone', 'latitude', 'longitude'),
+            pools['products'],
+            journal,
+        )
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+        journal.close()
+    cache_helpers.bump_catalogue_version()
+    assert failed == 0
+
+    return {
+        product['sku']: product
+        for product in cache_helpers.get_products()['data']
+    }
+
+
+def test_import_creates_products_with_images(cms, menu, imported_menu):
+    assert sorted(imported_menu) == sorted(str(item['id']) for item in menu)
+    assert len(cms.store.files) == PIZZAS_COUNT
+    for product in imported_menu.values():
+        main_image = product['relationships']['main_image']['data']
+        assert main_image['id'] in cms.store.files
+
+
+def test_menu_is_served_from_cache(cms, imported_menu):
+    product = next(iter(imported_menu.values()))
+    assert cache_helpers.get_products() is cache_helpers.get_products()
+
+    product_card = cache_helpers.get_product_card(product['id'])
+    assert product_card['id'] == product['id']
+    assert product_card['image_link']
+
+
+def test_cart_changes_are_batched_until_flush(imported_menu):
+    first, second = list(imported_menu.values())[:2]
+    cart_helpers.add_product_to_cart(CHAT_ID, first['id'])
+    cart_helpers.add_product_to_cart(CHAT_ID, first['id'])
+    cart_helpers.add_product_to_cart(CHAT_ID, second['id'], quantity=3)
+    assert cms_helpers.get_cart_items(CHAT_ID)['data'] == []
+
+    cart_items = cart_helpers.get_cart_items(CHAT_ID)
+    quantities = {
+        item['product_id']: item['quantity'] for item in cart_items['data']
+    }
+    assert quantities == {first['id']: 2, second['id']: 3}
+    assert cart_helpers.load_cart(CHAT_ID)['items'] == cart_items
+    assert cms_helpers.get_cart_items(CHAT_ID) == cart_items
+
+
+def test_cart_mirror_follows_removal(imported_menu):
+    cart_items = cart_helpers.get_cart_items(CHAT_ID)
+    removed_item = cart_items['data'][0]
+    cart_helpers.remove_cart_item(CHAT_ID, removed_item['id'])
+
+    cart_items = cart_helpers.get_cart_items(CHAT_ID, flush=False)
+    assert removed_item['id'] not in [
+        item['id'] for item in cart_items['data']
+    ]
+    assert cms_helpers.get_cart_items(CHAT_ID) == cart_items
+
+
+def test_checkout(cms, imported_menu):
+    product = next(iter(imported_menu.values()))
+    cart_helpers.add_product_to_cart(CHAT_ID, product['id'])
+    cart_helpers.reconcile_cart(CHAT_ID)
+    assert cart_helpers.load_cart(CHAT_ID)['items'] == \
+                                        cms_helpers.get_cart_items(CHAT_ID)
+
+    entry_data = {
+        'telegram_id': CHAT_ID,
+        'phone': '+79990000000',
+        'latitude': 55.75,
+        'longitude': 37.62,
+    }
+    customer_address = cms_async.submit(
+        cms_async.create_entry('Customer_Address', entry_data),
+    ).result(timeout=10)
+    assert customer_address['data']['telegram_id'] == CHAT_ID
+    assert len(cms.store.entries['customer_address']) == 1
@@ -14,10 +14,17 @@ from telegram.ext import MessageHandler
 from telegram.ext import PreCheckoutQueryHandler
 import phonenumbers
 import redis
+import requests
 
+import cache_helpers
+import cart_helpers
+import cms_async
 import cms_helpers
+import delivery_cells
 import ext_helpers
 import keyboards
+import pizzeria_registry
+import rate_limit
 
 
 logger = logging.getLogger(__file__)
@@ -33,6 +40,7 @@ DELIVERY_PRICE = {
     'LONG': 300
 }
 REMINDING_TIME = 5
+STATS_LOGGING_INTERVAL = 600
 PIZZERIA_NAME = 'НАЗВАНИЕ ЗАВЕДЕНИЯ'
 
 def handle_users_reply(update, context):
@@ -132,7 +140,7 @@ def show_menu(update, context):
         else:
             current_page = 1
 
-        products = cms_helpers.get_products()
+        products = cache_helpers.get_products()
         reply_keyboard = keyboards.get_menu_keyboard(products['data'], 
                                                                 current_page)
         query.message.reply_text(
@@ -158,11 +166,11 @@ def show_description(update, context):
 
     if 'DESCRIPTION' in query.data:
         user_reply, product_id = query.data.split('|')
-        product_data = cms_helpers.get_product(product_id)
-        image_id = (product_data['data']['relationships']
-                                                ['main_image']['data']['id'])
-        image_link = cms_helpers.get_image_link(image_id)
-        message = ext_helpers.format_product_info(product_data)
+        product_card = cache_helpers.get_product_card(product_id)
+        image_link = product_card['image_link']
+        if not image_link:
+            image_link = cache_helpers.get_image_link(product_card['image_id'])
+        message = ext_helpers.format_product_info(product_card)
         reply_keyboard = keyboards.get_product_details_keyboard(product_id)
         context.bot.send_photo(
             chat_id=chat_id,
@@ -179,15 +187,12 @@ def show_description(update, context):
 
     elif 'ADD_TO_CART' in query.data:
         user_reply, product_id = query.data.split('|')
-        adding_result = cms_helpers.add_product_to_cart(
-                chat_id,
-                product_id,
-            )
+        cart_helpers.add_product_to_cart(chat_id, product_id)
         context.bot.answer_callback_query(
                 callback_query_id=query.id, 
                 text='Товар добавлен в корзину', 
             )
-        logger.debug(f'Результат добавления товара в корзину: {adding_result}')
+        logger.debug(f'Товар {product_id} добавлен в корзину {chat_id}')
         return 'HANDLE_DESCRIPTION'
 
     else:
@@ -204,6 +209,7 @@ def show_cart(update, context):
     chat_id = query.message.chat_id
 
     if 'CHECKOUT' in query.data:
+        cart_helpers.reconcile_cart(chat_id)
         query.message.reply_text(
             text='Напишите свой номер телефона',
         )
@@ -217,12 +223,12 @@ def show_cart(update, context):
         if 'REMOVE_ITEM' in query.data:
             user_reply, item_id = query.data.split('|')
             logger.debug(f'Удаление товара с id {item_id}')
-            cms_helpers.remove_cart_item(chat_id, item_id)
+            cart_helpers.remove_cart_item(chat_id, item_id)
             context.bot.answer_callback_query(
                 callback_query_id=query.id, 
                 text='Товар удален из корзины', 
             )
-        cart_items = cms_helpers.get_cart_items(chat_id)
+        cart_items = cart_helpers.get_cart_items(chat_id)
         logger.debug(f'Товары в корзине: {cart_items}')
         query.message.reply_text(
             text=ext_helpers.format_cart(cart_items),
@@ -322,15 +328,16 @@ def choice_of_delivery(update, context):
             return 'HANDLE_DELIVERY'
 
     else:
-        nearest_pizzeria = ext_helpers.get_nearest_pizzeria(
-                                            context.user_data['location'])
-        pizzeria_id, distance_to_pizzeria = nearest_pizzeria
+        delivery_option = ext_helpers.get_delivery_option(
+            context.user_data['location'],
+            DELIVERY_RADIUS,
+            DELIVERY_PRICE,
+        )
+        pizzeria_id, distance_to_pizzeria, delivery_area = delivery_option
         context.user_data['nearest_pizzeria_id'] = pizzeria_id
-        delivery_area = ext_helpers.get_delivery_area(distance_to_pizzeria, 
-                                                            DELIVERY_RADIUS)
         logger.debug(f'delivery_area: {delivery_area}')
-        pizzeria = cms_helpers.get_an_entry('pizzeria', pizzeria_id)
-        pizzeria_address = pizzeria['data']['address']
+        pizzeria = pizzeria_registry.get_registry().get(pizzeria_id)
+        pizzeria_address = pizzeria['address']
         logger.debug(f'pizzeria_address: {pizzeria_address}')
 
         pick_up_message = f'''
@@ -358,7 +365,7 @@ def pick_up(update, context):
     logger.debug(f'user_data: {context.user_data}')
 
     chat_id = update.callback_query.message.chat_id
-    cart_items = cms_helpers.get_cart_items(chat_id)
+    cart_items = cart_helpers.get_cart_items(chat_id)
     prices = ext_helpers.get_labeled_prices(cart_items)
 
     context.bot.sendInvoice(
@@ -378,25 +385,27 @@ def delivery(update, context):
     logger.debug(f'user_data: {context.user_data}')
 
     chat_id = update.callback_query.message.chat_id
-    cart_items = cms_helpers.get_cart_items(chat_id)
     user_location = context.user_data['location']
     lat, lon = user_location
-    nearest_pizzeria = ext_helpers.get_nearest_pizzeria(user_location)
-    pizzeria_id, distance_to_pizzeria = nearest_pizzeria
-    delivery_area = ext_helpers.get_delivery_area(
-            distance_to_pizzeria,
-            DELIVERY_RADIUS,
-        )
-    delivery_price = DELIVERY_PRICE[delivery_area]
-    prices = ext_helpers.get_labeled_prices(cart_items, delivery_price)
-
     entry_data = {
         'telegram_id': chat_id,
         'phone': context.user_data['phone'],
         'latitude': lat,
         'longitude': lon,
     }
-    cms_helpers.create_entry('Customer_Address', entry_data)
+    customer_address = cms_async.submit(
+        cms_async.create_entry('Customer_Address', entry_data),
+    )
+    cart_items = cart_helpers.get_cart_items(chat_id)
+    delivery_option = ext_helpers.get_delivery_option(
+            user_location,
+            DELIVERY_RADIUS,
+            DELIVERY_PRICE,
+        )
+    pizzeria_id, distance_to_pizzeria, delivery_area = delivery_option
+    delivery_price = DELIVERY_PRICE[delivery_area]
+    prices = ext_helpers.get_labeled_prices(cart_items, delivery_price)
+    customer_address.result()
 
     context.bot.sendInvoice(
         chat_id=chat_id, 
@@ -433,10 +442,10 @@ def successful_payment_callback(update, context):
     chat_id = update.message.chat.id
     lat, lon = context.user_data['location']
     pizzeria_id = context.user_data['nearest_pizzeria_id']
-    pizzeria = cms_helpers.get_an_entry('pizzeria', pizzeria_id)
-    pizzeria_address = pizzeria['data']['address']
-    delivery_man = pizzeria['data']['delivery_man']
-    cart_items = cms_helpers.get_cart_items(chat_id)
+    pizzeria = pizzeria_registry.get_registry().get(pizzeria_id)
+    cart_items = cart_helpers.get_cart_items(chat_id)
+    pizzeria_address = pizzeria['address']
+    delivery_man = pizzeria['delivery_man']
     formated_cart_items = ext_helpers.format_cart(cart_items)
 
     if context.user_data['delivery']:
@@ -501,6 +510,31 @@ def remind_about_order(context):
     )
 
 
+def warm_up_caches(context):
+    with rate_limit.priority(rate_limit.BULK):
+        cache_helpers.get_products()
+    refresh_pizzerias(context)
+
+
+def refresh_pizzerias(context):
+    try:
+        with rate_limit.priority(rate_limit.BULK):
+            pizzeria_registry.get_registry().refresh()
+    except requests.exceptions.RequestException:
+        logger.warning('Не удалось обновить список пиццерий', exc_info=True)
+
+
+def log_cms_pool_stats(context):
+    logger.debug(f'Пул соединений с CMS: {cms_helpers.get_session_stats()}')
+    logger.debug(f'Очередь запросов к CMS: {rate_limit.get_stats()}')
+    logger.debug(f'Состояние CMS: '
+                            f'{cms_helpers.get_circuit_breaker().get_stats()}')
+    logger.debug(f'Пиццерии: {pizzeria_registry.get_registry().get_stats()}')
+    logger.debug(f'Кэш геокодера: {cache_helpers.get_geocode_stats()}')
+    logger.debug(f'Кэш зон доставки: '
+                        f'{delivery_cells.get_delivery_cells().get_stats()}')
+
+
 def main():
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
@@ -518,20 +552,62 @@ def main():
     cms_helpers_logger.addHandler(console_handler)
     cms_helpers_logger.setLevel(logging.DEBUG)
 
+    cache_helpers_logger = logging.getLogger('cache_helpers')
+    cache_helpers_logger.addHandler(console_handler)
+    cache_helpers_logger.setLevel(logging.DEBUG)
+
     ext_helpers_logger = logging.getLogger('ext_helpers')
     ext_helpers_logger.addHandler(console_handler)
     ext_helpers_logger.setLevel(logging.DEBUG)
 
+    circuit_breaker_logger = logging.getLogger('circuit_breaker')
+    circuit_breaker_logger.addHandler(console_handler)
+    circuit_breaker_logger.setLevel(logging.DEBUG)
+
+    cart_helpers_logger = logging.getLogger('cart_helpers')
+    cart_helpers_logger.addHandler(console_handler)
+    cart_helpers_logger.setLevel(logging.DEBUG)
+
+    cms_async_logger = logging.getLogger('cms_async')
+    cms_async_logger.addHandler(console_handler)
+    cms_async_logger.setLevel(logging.DEBUG)
+
+    pizzeria_registry_logger = logging.getLogger('pizzeria_registry')
+    pizzeria_registry_logger.addHandler(console_handler)
+    pizzeria_registry_logger.setLevel(logging.DEBUG)
+
+    geo_helpers_logger = logging.getLogger('geo_helpers')
+    geo_helpers_logger.addHandler(console_handler)
+    geo_helpers_logger.setLevel(logging.DEBUG)
+
+    delivery_cells_logger = logging.getLogger('delivery_cells')
+    delivery_cells_logger.addHandler(console_handler)
+    delivery_cells_logger.setLevel(logging.DEBUG)
+
     keyboards_logger = logging.getLogger('keyboards')
     keyboards_logger.addHandler(console_handler)
     keyboards_logger.setLevel(logging.DEBUG)
 
     load_dotenv()
+    workers = int(os.getenv('TELEGRAM_WORKERS', 4))
+    cms_helpers.get_session(pool_size=workers)
     updater = Updater(
             token=os.getenv('TELEGRAM_TOKEN'),
             use_context=True,
+            workers=workers,
         )
     job_queue = updater.job_queue
+    job_queue.run_once(callback=warm_up_caches, when=0)
+    job_queue.run_repeating(
+        callback=log_cms_pool_stats,
+        interval=STATS_LOGGING_INTERVAL,
+    )
+    refresh_interval = pizzeria_registry.get_refresh_interval()
+    job_queue.run_repeating(
+        callback=refresh_pizzerias,
+        interval=refresh_interval,
+        first=refresh_interval,
+    )
 
     start_handler = CommandHandler('start', handle_users_reply)
     users_reply_handler = CallbackQueryHandler(handle_users_reply, 